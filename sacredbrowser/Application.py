@@ -7,6 +7,7 @@ from . import BrowserState
 from . import SortedExperimentList
 from . import SortDialog
 from . import DetailsDialog
+from . import ConnectDialog
 
 from PyQt5 import QtCore, QtGui, QtWidgets
 
@@ -204,13 +205,15 @@ class Application(QtWidgets.QApplication):
 
     def _slot_connect_to_db(self):
         last_uri = self.settings.value('Global/lastMongoUri')
-        if last_uri is None:
-            last_uri = 'mongodb://localhost:27017'
-        new_uri, okPressed = QtWidgets.QInputDialog.getText(None, 'Create mongo connection','Mongo URI:', QtWidgets.QLineEdit.Normal, last_uri)
-        if okPressed and new_uri != '':
-            self._connection.connect(new_uri)
-            # TODO and on error?
-            self.settings.setValue('Global/lastMongoUri',new_uri)
+        last_profile_name = self.settings.value('Global/lastConnectionProfile')
+        dialog = ConnectDialog.ConnectDialog(self.settings,last_profile_name,last_uri)
+        if dialog.exec_() == QtWidgets.QDialog.Accepted:
+            profile = dialog.get_profile()
+            if profile.uri != '':
+                self._connection.connect(profile.uri,profile)
+                # TODO and on error?
+                self.settings.setValue('Global/lastMongoUri',profile.uri)
+                self.settings.setValue('Global/lastConnectionProfile',profile.name)
 
     def _slot_field_choice_down_clicked(self):
         self._controller.field_down()
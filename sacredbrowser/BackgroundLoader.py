@@ -0,0 +1,77 @@
+# This file contains the background loader, which runs database queries on a worker thread so that the
+# GUI never blocks while waiting for the database.
+#
+# A job consists of three callables:
+# - the fetcher runs on the worker thread. It must be a generator function, and may only access the database
+#   (never any Qt objects or DbEntries objects). Each yielded result (e.g. a batch of documents) is passed to
+# - the receiver, which is called on the main thread and applies the result (usually to an ObjectHolder).
+# - Finally the finisher is called on the main thread, with the exception raised by the fetcher, or None.
+# Jobs are processed one after the other, in the order of submission.
+
+from PyQt5 import QtCore
+
+# The worker object, which lives in the worker thread
+class _Worker(QtCore.QObject):
+    result_ready = QtCore.pyqtSignal(object,object) # receiver, result
+    job_finished = QtCore.pyqtSignal(object,object) # finisher, exception or None
+
+    def __init__(self):
+        super().__init__()
+        self.cancelled = False
+
+    def slot_run_job(self,job):
+        fetcher,receiver,finisher = job
+        error = None
+        try:
+            for result in fetcher():
+                if self.cancelled:
+                    break
+                self.result_ready.emit(receiver,result)
+        except Exception as e:
+            error = e
+        self.job_finished.emit(finisher,error)
+
+class BackgroundLoader(QtCore.QObject):
+    _job_submitted = QtCore.pyqtSignal(object)
+
+    def __init__(self,parent=None):
+        super().__init__(parent)
+        self._thread = QtCore.QThread()
+        self._worker = _Worker()
+        self._worker.moveToThread(self._thread)
+
+        # all these connections are queued, since the objects live in different threads
+        self._job_submitted.connect(self._worker.slot_run_job)
+        self._worker.result_ready.connect(self._slot_result_ready)
+        self._worker.job_finished.connect(self._slot_job_finished)
+
+        self._thread.start()
+
+        app = QtCore.QCoreApplication.instance()
+        if app is not None:
+            app.aboutToQuit.connect(self.shutdown)
+
+    # Submit a job (see above), must be called from the main thread
+    def submit(self,fetcher,receiver,finisher):
+        self._job_submitted.emit((fetcher,receiver,finisher))
+
+    # Stop the worker thread. A running job is abandoned after the next result.
+    def shutdown(self):
+        self._worker.cancelled = True
+        self._thread.quit()
+        self._thread.wait()
+
+    def _slot_result_ready(self,receiver,result):
+        receiver(result)
+
+    def _slot_job_finished(self,finisher,error):
+        finisher(error)
+
+_background_loader = None
+
+# Returns the (singleton) background loader, which is created on first use
+def get_background_loader():
+    global _background_loader
+    if _background_loader is None:
+        _background_loader = BackgroundLoader()
+    return _background_loader
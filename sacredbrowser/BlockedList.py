@@ -0,0 +1,157 @@
+# This file contains the blocked list, which holds the ordered keys of an ObjectHolder (see Utilities). Keys
+# must be unique and hashable. The keys are divided into blocks of at most BlockSize keys, so that inserting
+# or removing a range of keys only moves the keys of the affected blocks. The start position of each block is
+# kept in a list of offsets, which is used to find the block of a position by bisection, and each key knows
+# its block, so that the position of a key is found without scanning the list.
+#
+# Offsets are recomputed (in time proportional to the number of blocks) when they are needed after a change,
+# and the position of a key within its block is looked up in a map which is likewise rebuilt on demand.
+
+import bisect
+import itertools
+
+class _Block:
+    __slots__ = ('items','positions','number')
+
+    def __init__(self,items):
+        self.items = items
+        self.positions = None # key -> position within the block, None if it must be rebuilt
+        self.number = 0 # position of the block in the list of blocks, valid while the offsets are valid
+
+    def get_position(self,key):
+        if self.positions is None:
+            self.positions = { k: pos for pos,k in enumerate(self.items) }
+        return self.positions[key]
+
+class BlockedList:
+    BlockSize = 512
+
+    def __init__(self,keys=()):
+        self._blocks = []
+        self._block_of = {} # key -> block
+        self._length = 0
+        self._offsets = [] # start position of each block, None if it must be rebuilt
+        self._append_blocks(list(keys))
+
+    def __len__(self):
+        return self._length
+
+    def __contains__(self,key):
+        return key in self._block_of
+
+    def __iter__(self):
+        for block in self._blocks:
+            yield from block.items
+
+    def __getitem__(self,pos):
+        if pos < 0:
+            pos += self._length
+        if not 0 <= pos < self._length:
+            raise IndexError('BlockedList index out of range')
+        block_no = self._find_block(pos)
+        return self._blocks[block_no].items[pos - self._get_offsets()[block_no]]
+
+    # Returns the position of the key, raises a ValueError if the key is not present (like list.index)
+    def index(self,key):
+        block = self._block_of.get(key)
+        if block is None:
+            raise ValueError('%s is not in list' % str(key))
+        offsets = self._get_offsets()
+        return offsets[block.number] + block.get_position(key)
+
+    def to_list(self):
+        result = []
+        for block in self._blocks:
+            result.extend(block.items)
+        return result
+
+    # Insert the given keys (a list) before position pos
+    def insert(self,pos,keys):
+        if len(keys) == 0:
+            return
+        if not 0 <= pos <= self._length:
+            raise IndexError('BlockedList index out of range')
+        if pos == self._length:
+            block_no = len(self._blocks) - 1
+        else:
+            block_no = self._find_block(pos)
+        if block_no < 0:
+            self._append_blocks(list(keys))
+            return
+
+        block = self._blocks[block_no]
+        offset = pos - self._get_offsets()[block_no]
+        block.items[offset:offset] = keys
+        block.positions = None
+        for key in keys:
+            self._block_of[key] = block
+        self._length += len(keys)
+        if len(block.items) > self.BlockSize:
+            self._split_block(block_no)
+        self._offsets = None
+
+    # Remove count keys, starting at position pos
+    def delete(self,pos,count):
+        if count <= 0:
+            return
+        if not (0 <= pos and pos + count <= self._length):
+            raise IndexError('BlockedList index out of range')
+        block_no = self._find_block(pos)
+        offset = pos - self._get_offsets()[block_no]
+        remaining = count
+        while remaining > 0:
+            block = self._blocks[block_no]
+            removed = block.items[offset:offset + remaining]
+            del block.items[offset:offset + remaining]
+            block.positions = None
+            for key in removed:
+                del self._block_of[key]
+            remaining -= len(removed)
+            if len(block.items) == 0:
+                del self._blocks[block_no]
+            else:
+                block_no += 1
+            offset = 0
+        self._length -= count
+        self._offsets = None
+
+        # many small blocks remain after scattered removals
+        if len(self._blocks) > 2 * (self._length // self.BlockSize + 1):
+            self._rebalance()
+
+    ############# Internals #############
+    def _get_offsets(self):
+        if self._offsets is None:
+            for number,block in enumerate(self._blocks):
+                block.number = number
+            self._offsets = [ 0 ] + list(itertools.accumulate(len(block.items) for block in self._blocks))[:-1]
+        return self._offsets
+
+    # Returns the number of the block containing the position
+    def _find_block(self,pos):
+        return bisect.bisect_right(self._get_offsets(),pos) - 1
+
+    def _append_blocks(self,keys):
+        for start in range(0,len(keys),self.BlockSize):
+            block = _Block(keys[start:start + self.BlockSize])
+            for key in block.items:
+                self._block_of[key] = block
+            self._blocks.append(block)
+        self._length += len(keys)
+        self._offsets = None
+
+    def _split_block(self,block_no):
+        items = self._blocks[block_no].items
+        half = self.BlockSize // 2
+        new_blocks = [ _Block(items[start:start + half]) for start in range(0,len(items),half) ]
+        for block in new_blocks:
+            for key in block.items:
+                self._block_of[key] = block
+        self._blocks[block_no:block_no + 1] = new_blocks
+
+    def _rebalance(self):
+        keys = self.to_list()
+        self._blocks = []
+        self._block_of = {}
+        self._length = 0
+        self._append_blocks(keys)
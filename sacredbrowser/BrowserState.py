@@ -83,7 +83,9 @@ class SortOrder(QtCore.QObject):
         super().__init__()
         self._available_fields = []
         self._order = [] # order as list, a subset of _available_fields
+        self._saved_order = [] # order as saved, may contain fields which are not available yet (see _prune_saved_order)
 
+        self._study = None
         self._current_qualified_study_id = None
 
     def set_available_fields(self,fields,reset=False):
@@ -96,10 +98,10 @@ class SortOrder(QtCore.QObject):
         # require a complete reset is when the study is changed - and that is covered by slot_study_changed
         if 1: 
             # reuse old order as much as possible
-            new_order = [ x for x in self._order if x in self._available_fields ]
+            new_order = [ x for x in self._saved_order if x in self._available_fields ]
             self._order = new_order
+        self._prune_saved_order()
 
-        self._save_sort_order()
         self.sort_order_changed.emit(self._order,reset)
 
     def sort_request(self,field,pos):
@@ -127,6 +129,8 @@ class SortOrder(QtCore.QObject):
             self._order.insert(pos,field)
 #             del self._order[-1]
 
+        self._saved_order = self._order + [ x for x in self._saved_order if x not in self._order ]
+        self._prune_saved_order()
         self._save_sort_order()
         self.sort_order_changed.emit(self._order,False)
 
@@ -140,16 +144,27 @@ class SortOrder(QtCore.QObject):
         pass # done by slot_fields_changed
 
     def slot_study_changed(self,study):
+        self._study = study
         self._current_qualified_study_id = study.qualified_id() if study is not None else None
         self._load_sort_order()
 
     def slot_visible_fields_changed(self,visible,change_data):
         self.set_available_fields(visible,reset=change_data.tp == Fields.ChangeType.Reset) # likewise emits change signal
 
+    # While the study is being loaded, its fields may not be known yet, so fields which are not available remain
+    # in the saved order. Otherwise they are dropped (e.g. hidden fields), so that they do not return to their old
+    # position when they become available again, and do not accumulate in the settings.
+    def _prune_saved_order(self):
+        if self._study is not None and self._study.is_loading():
+            return
+        if len(self._order) < len(self._saved_order):
+            self._saved_order = list(self._order)
+            self._save_sort_order()
+
     def _save_sort_order(self):
         if self._current_qualified_study_id is not None:
             settings = Application.Application.get_global_settings()
-            settings.setValue(self._current_qualified_study_id + '/SortOrder/order',self._order)
+            settings.setValue(self._current_qualified_study_id + '/SortOrder/order',self._saved_order)
 
     def _load_sort_order(self):
         settings = Application.Application.get_global_settings()
@@ -161,7 +176,8 @@ class SortOrder(QtCore.QObject):
             loaded_order = []
         # TODO match this against availabel fields - problem since the signals for the new study and for visible fields might 
         # arrive in any order
-        self._order = loaded_order
+        self._saved_order = loaded_order
+        self._order = list(loaded_order)
         self.sort_order_changed.emit(self._order,True)
 
 
@@ -261,6 +277,11 @@ class Fields(QtCore.QObject):
 
         self._current_qualified_study_id = None
 
+        # study which is still being loaded, fields are set when they have been discovered, and again when loading has finished
+        self._pending_study = None
+        # study whose field changes are followed
+        self._connected_study = None
+
     def set_fields(self,invisible,visible):
         # This might be called when new data is loaded, or the study is changed, or fields  are
         # loaded from storage. Note that other functions also change the list of fields.
@@ -393,10 +414,30 @@ class Fields(QtCore.QObject):
         self._save_fields()
 
     def slot_study_to_be_changed(self,study):
-        pass # done by slot_fields_changed
+        self._stop_waiting_for_study()
+        if self._connected_study is not None:
+            self._connected_study.fields_changed.disconnect(self._slot_study_fields_changed)
+            self._connected_study = None
 
 
     def slot_study_changed(self,study):
+        if study is not None and self._connected_study is not study:
+            study.fields_changed.connect(self._slot_study_fields_changed)
+            self._connected_study = study
+
+        fields_unknown = study is not None and (study.is_paged() or (study.is_loading() and not study.is_initialized()))
+        if fields_unknown and not study.has_discovered_fields():
+            # Fields are not known yet. Do not touch the saved fields of the study, but wait until the fields
+            # have been discovered, or loading has finished.
+            self._current_qualified_study_id = None
+            self.set_fields([],[])
+            self._wait_for_study(study)
+            return
+
+        if study is not None and study.is_loading():
+            # fields might change when loading has finished
+            self._wait_for_study(study)
+
         # give the fields the format (type, field), this allows to sort naturally
         if study is not None:
             config_fields = [ (Fields.FieldType.Config, x) for x in study.list_config_fields() ]
@@ -408,6 +449,32 @@ class Fields(QtCore.QObject):
 
         self._load_fields(config_fields + result_fields)
 
+    def _wait_for_study(self,study):
+        self._stop_waiting_for_study()
+        self._pending_study = study
+        self._pending_study.load_finished.connect(self._slot_study_loaded)
+        self._pending_study.fields_discovered.connect(self._slot_study_loaded)
+
+    def _stop_waiting_for_study(self):
+        if self._pending_study is not None:
+            self._pending_study.load_finished.disconnect(self._slot_study_loaded)
+            self._pending_study.fields_discovered.disconnect(self._slot_study_loaded)
+            self._pending_study = None
+
+    def _slot_study_loaded(self,study):
+        self._stop_waiting_for_study()
+        self.slot_study_changed(study)
+
+    # Fields of the current study appeared or vanished (after a reload). New fields are made visible, as in _load_fields.
+    def _slot_study_fields_changed(self,study,appeared,vanished):
+        if study.is_loading() or self._current_qualified_study_id is None:
+            return # fields are set when loading has finished
+        available = set(self.get_available_fields())
+        vanished = set(vanished)
+        invisible = [ x for x in self._invisible_fields if x not in vanished ]
+        visible = [ x for x in self._visible_fields if x not in vanished ] + [ x for x in appeared if x not in available ]
+        self.set_fields(invisible,visible)
+
     def _save_fields(self):
         if self._current_qualified_study_id is None:
             return
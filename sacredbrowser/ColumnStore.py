@@ -0,0 +1,244 @@
+# This file contains the column store of a study, which holds the flattened config and result values of all
+# experiments (see parse_config and parse_result in DbEntries). Instead of one dictionary per experiment, there
+# is one column per field, and each experiment owns a row (see SacredExperiment). Fields are identified as in
+# BrowserState.Fields, i.e. as (FieldType, name).
+#
+# Columns which only contain integers (or floats) are stored as int64 (or float64) NumPy arrays, all other columns
+# are object arrays. A column is converted to an object array as soon as a value does not fit. Each column has a
+# mask of the rows which have a value for the field.
+#
+# Fields which only occur in a few experiments would need full arrays as well, so a column starts out sparse (a
+# dictionary row -> value, see _SparseColumn) and only becomes dense (NumPy arrays) when more than DenseFraction
+# of the rows have a value.
+#
+# Additionally, the fields of each row are stored as a shape (a tuple of fields, in a fixed order), and rows
+# with the same fields share the same shape object. Values are passed to and from the store as tuples in the
+# order of the shape. Since experiments from the same sweep have the same fields, there are usually very few shapes.
+# Shapes belong to the store (see get_shape), so they are released together with the study.
+
+import numpy as np
+
+class Shape:
+    __slots__ = ('fields','field_set')
+
+    def __init__(self,fields):
+        self.fields = fields
+        self.field_set = frozenset(fields)
+
+# the shape of rows without fields, which is shared by all stores
+EmptyShape = Shape(())
+
+class _Column:
+    __slots__ = ('values','present','count')
+
+    dense = True
+
+    def __init__(self,dtype,capacity):
+        self.values = np.zeros(capacity,dtype=dtype) if dtype is not object else np.full(capacity,None,dtype=object)
+        self.present = np.zeros(capacity,dtype=bool)
+        self.count = 0 # number of rows with a value
+
+    @classmethod
+    def from_sparse(cls,sparse_column,capacity):
+        column = cls(sparse_column.dtype,capacity)
+        for row,value in sparse_column.values.items():
+            column.values[row] = value
+            column.present[row] = True
+        column.count = len(sparse_column.values)
+        return column
+
+    def is_numeric(self):
+        return self.values.dtype != object
+
+    def resize(self,capacity):
+        old_size = len(self.present)
+        values = np.zeros(capacity,dtype=self.values.dtype) if self.is_numeric() else np.full(capacity,None,dtype=object)
+        values[:old_size] = self.values
+        present = np.zeros(capacity,dtype=bool)
+        present[:old_size] = self.present
+        self.values = values
+        self.present = present
+
+    # Python types of values which can be stored in numeric columns, and the respective column type
+    NumericTypes = { int: np.int64, float: np.float64 }
+    Int64Range = (-2**63,2**63 - 1)
+
+    @classmethod
+    def dtype_for_value(cls,value):
+        dtype = cls.NumericTypes.get(type(value),object) # note that bool is not int here
+        if dtype is np.int64 and not (cls.Int64Range[0] <= value <= cls.Int64Range[1]):
+            dtype = object
+        return dtype
+
+    def set(self,row,value):
+        if self.is_numeric() and self.dtype_for_value(value) is not self.values.dtype.type:
+            # convert to python objects (which are then exactly the original values)
+            self.values = self.values.astype(object)
+            self.values[~self.present] = None
+        self.values[row] = value
+        if not self.present[row]:
+            self.present[row] = True
+            self.count += 1
+
+    def clear(self,row):
+        if self.present[row]:
+            self.present[row] = False
+            self.count -= 1
+            if not self.is_numeric():
+                self.values[row] = None
+
+    def has(self,row):
+        return bool(self.present[row])
+
+    def get(self,row):
+        value = self.values[row]
+        return value.item() if self.is_numeric() else value
+
+# A column with few values, which only remembers the type of a dense column (see _Column)
+class _SparseColumn:
+    __slots__ = ('values','dtype')
+
+    dense = False
+
+    def __init__(self,dtype):
+        self.values = {}
+        self.dtype = dtype
+
+    @property
+    def count(self):
+        return len(self.values)
+
+    def is_numeric(self):
+        return self.dtype is not object
+
+    def resize(self,capacity):
+        pass
+
+    def set(self,row,value):
+        if self.dtype is not object and _Column.dtype_for_value(value) is not self.dtype:
+            self.dtype = object
+        self.values[row] = value
+
+    def clear(self,row):
+        self.values.pop(row,None)
+
+    def has(self,row):
+        return row in self.values
+
+    def get(self,row):
+        return self.values[row]
+
+class ColumnStore:
+    InitialCapacity = 64
+    DenseFraction = 0.125
+
+    def __init__(self):
+        self._capacity = self.InitialCapacity
+        self._columns = {}
+        # shape of each row (None for free rows)
+        self._row_shapes = [ None ] * self._capacity
+        # rows which are not in use, the top one is used next
+        self._free_rows = list(reversed(range(self._capacity)))
+        # shapes of this store by their fields, and by the keys passed to get_shape_by_key
+        self._shapes = { (): EmptyShape }
+        self._shapes_by_key = {}
+
+    # Returns the (shared) shape for the given tuple of fields
+    def get_shape(self,fields):
+        shape = self._shapes.get(fields)
+        if shape is None:
+            shape = Shape(fields)
+            self._shapes[fields] = shape
+        return shape
+
+    # Returns the shape for the given key (any hashable value which determines the fields), make_fields is only
+    # called if the key is new
+    def get_shape_by_key(self,key,make_fields):
+        shape = self._shapes_by_key.get(key)
+        if shape is None:
+            shape = self.get_shape(make_fields())
+            self._shapes_by_key[key] = shape
+        return shape
+
+    # Returns a new (empty) row
+    def allocate_row(self):
+        if len(self._free_rows) == 0:
+            self._grow()
+        row = self._free_rows.pop()
+        self._row_shapes[row] = EmptyShape
+        return row
+
+    def free_row(self,row):
+        self.clear_row(row)
+        self._row_shapes[row] = None
+        self._free_rows.append(row)
+
+    # Set the values of the given row, values is a tuple in the order of the shape
+    def set_row_values(self,row,shape,values):
+        old_shape = self._row_shapes[row]
+        if old_shape is not shape:
+            for field in old_shape.fields:
+                if field not in shape.field_set:
+                    self._columns[field].clear(row)
+        for field,value in zip(shape.fields,values):
+            column = self._columns.get(field)
+            if column is None:
+                column = _SparseColumn(_Column.dtype_for_value(value))
+                self._columns[field] = column
+            column.set(row,value)
+            if not column.dense and column.count > self._capacity * self.DenseFraction:
+                self._columns[field] = _Column.from_sparse(column,self._capacity)
+        self._row_shapes[row] = shape
+        if old_shape is not shape:
+            self._remove_empty_columns(old_shape.fields)
+
+    def clear_row(self,row):
+        self.set_row_values(row,EmptyShape,())
+
+    # Accessors. The row may be None (e.g. for an experiment which has been deleted), which has no values.
+
+    def get_row_shape(self,row):
+        return self._row_shapes[row] if row is not None else EmptyShape
+
+    # Returns the fields of the row, in the order of its shape
+    def get_row_fields(self,row):
+        return self.get_row_shape(row).fields
+
+    # Returns a dictionary field -> value for the given row
+    def get_row(self,row):
+        return { field: self._columns[field].get(row) for field in self.get_row_fields(row) }
+
+    def has_value(self,row,field):
+        column = self._columns.get(field)
+        return column is not None and row is not None and column.has(row)
+
+    def get_value(self,row,field,default=None):
+        column = self._columns.get(field)
+        if column is None or row is None or not column.has(row):
+            return default
+        return column.get(row)
+
+    # True if all values of the field are stored as numbers
+    def is_numeric_column(self,field):
+        column = self._columns.get(field)
+        return column is not None and column.is_numeric()
+
+    # Number of rows which have a value for the field
+    def get_value_count(self,field):
+        column = self._columns.get(field)
+        return column.count if column is not None else 0
+
+    ############# Internals #############
+    def _grow(self):
+        old_capacity = self._capacity
+        self._capacity *= 2
+        for column in self._columns.values():
+            column.resize(self._capacity)
+        self._row_shapes.extend([ None ] * (self._capacity - old_capacity))
+        self._free_rows.extend(reversed(range(old_capacity,self._capacity)))
+
+    def _remove_empty_columns(self,fields):
+        for field in fields:
+            column = self._columns.get(field)
+            if column is not None and column.count == 0:
+                del self._columns[field]
@@ -4,6 +4,64 @@ import copy
 
 # some global configuration obtions, currently hardcoded
 
+# Live updates of the current study: if WatchStudies is set, a MongoDB change stream is opened on the
+# runs collection and polled every StudyWatchInterval ms. Servers without change stream support (standalone 
+# servers) are instead polled for changes every StudyPollInterval ms.
+WatchStudies = True
+StudyWatchInterval = 500
+StudyPollInterval = 5000
+
+# For very large studies: if UsePagedExperimentList is set, experiments are not loaded into memory, but
+# the experiment list fetches pages of rows from the server as they are displayed (see PagedExperimentListModel).
+UsePagedExperimentList = False
+
+# Number of config dictionaries (by dotted prefix) whose flattened field names are remembered (the cache is
+# cleared when it grows larger)
+FieldNameCacheSize = 100000
+
+# In the details dialog, text entries (such as captured_out) which are larger than LargeTextSize bytes are 
+# displayed in a viewer which loads chunks of TextChunkSize characters from the server
+LargeTextSize = 1000000
+TextChunkSize = 65536
+
+# Attached files are previewed up to FilePreviewSize bytes
+FilePreviewSize = 256 * 1024
+
+# Contents of attached files (up to FileCacheMaxFileSize bytes each) are cached in memory, up to FileCacheSize
+# bytes in total. If FileCacheSpillDirectory is set (relative to the home directory), files which are 
+# removed from memory are kept there, up to FileCacheSpillSize bytes.
+FileCacheSize = 64 * 1024 * 1024
+FileCacheMaxFileSize = 4 * 1024 * 1024
+FileCacheSpillDirectory = None
+FileCacheSpillSize = 512 * 1024 * 1024
+
+# The captured output of running experiments can be followed in the details dialog, the server is polled every
+# TextFollowInterval ms (new text is only requested if the heartbeat of the experiment has changed)
+TextFollowInterval = 2000
+
+# Changes of lists of database objects (databases, studies, experiments) are passed to the views as ranges
+# of removed and inserted rows. If there are more than MaxChangeRanges ranges, the views are reset instead.
+MaxChangeRanges = 50
+
+# The study tree shows the number of runs and the last heartbeat of each study (if ShowStudyStatistics is set).
+# These statistics, as well as the collections of all databases, are loaded by StudyTreeThreadCount threads
+# at the same time. Statistics are recomputed after StudyStatisticsTTL seconds.
+ShowStudyStatistics = True
+StudyTreeThreadCount = 8
+StudyStatisticsTTL = 60
+
+# Field names are discovered by the server (before the experiments are loaded), up to the given nesting depth
+# of config dictionaries. Deeper dictionaries are shown as a single field until the experiments have been loaded.
+FieldDiscoveryDepth = 8
+
+# Sorting by config or result fields is done by the server when possible. If CreateSortIndexes is set, an index
+# is created for each requested sort order (note that this modifies the database).
+CreateSortIndexes = False
+
+# Experiment skeletons are cached on disk (in the home directory), so that studies can be reopened quickly.
+UseSkeletonCache = True
+SkeletonCacheFile = '.sacredbrowser_skeleton_cache.sqlite'
+
 # compareFunc creates a key to compare different database entries, with the goal of finding
 # duplicates. Currently only removes the entry "seed".
 # compareFunc = lambda dct: dct['config']
@@ -0,0 +1,145 @@
+from . import ConnectionProfiles
+
+from PyQt5 import QtCore, QtGui, QtWidgets
+
+import pymongo.errors
+
+# This dialog asks for the connection settings (see ConnectionProfiles). Profiles can be saved and deleted,
+# and probed for latency and throughput before connecting.
+class ConnectDialog(QtWidgets.QDialog):
+
+    def __init__(self,settings,last_profile_name=None,last_uri=None):
+        super(ConnectDialog,self).__init__()
+        self._settings = settings
+        self.setWindowTitle('Create mongo connection')
+
+        self._make_layout()
+        self._update_profile_list(last_profile_name)
+
+        profile_names = ConnectionProfiles.ConnectionProfile.list_names(self._settings)
+        if last_profile_name in profile_names:
+            self._show_profile(ConnectionProfiles.ConnectionProfile.load(self._settings,last_profile_name))
+        else:
+            self._show_profile(ConnectionProfiles.ConnectionProfile(uri=last_uri) if last_uri is not None else ConnectionProfiles.ConnectionProfile())
+
+        # connections
+        self._profile_combo.activated[str].connect(self._slot_profile_selected)
+        self._save_button.clicked.connect(self._slot_save_clicked)
+        self._delete_button.clicked.connect(self._slot_delete_clicked)
+        self._probe_button.clicked.connect(self._slot_probe_clicked)
+        self._ok_button.clicked.connect(self.accept)
+        self._cancel_button.clicked.connect(self.reject)
+
+    # Returns the profile with the settings from the dialog
+    def get_profile(self):
+        profile = ConnectionProfiles.ConnectionProfile(self._name_edit.text().strip() or 'Default',self._uri_edit.text().strip())
+        profile.max_pool_size = self._pool_size_spin.value()
+        profile.compressors = ','.join(c for c in ConnectionProfiles.ConnectionProfile.Compressors if self._compressor_checkboxes[c].isChecked())
+        profile.read_preference = self._read_preference_combo.currentText()
+        profile.batch_size = self._batch_size_spin.value()
+        profile.socket_timeout = self._socket_timeout_spin.value()
+        return profile
+
+    def _make_layout(self):
+        # widgets
+        self._profile_combo = QtWidgets.QComboBox()
+        self._name_edit = QtWidgets.QLineEdit()
+        self._uri_edit = QtWidgets.QLineEdit()
+        self._pool_size_spin = QtWidgets.QSpinBox()
+        self._pool_size_spin.setRange(1,1000)
+        self._compressor_checkboxes = { c: QtWidgets.QCheckBox(c) for c in ConnectionProfiles.ConnectionProfile.Compressors }
+        self._read_preference_combo = QtWidgets.QComboBox()
+        self._read_preference_combo.addItems(ConnectionProfiles.ConnectionProfile.ReadPreferences)
+        self._batch_size_spin = QtWidgets.QSpinBox()
+        self._batch_size_spin.setRange(0,100000)
+        self._batch_size_spin.setSpecialValueText('Server default')
+        self._socket_timeout_spin = QtWidgets.QSpinBox()
+        self._socket_timeout_spin.setRange(0,3600000)
+        self._socket_timeout_spin.setSingleStep(1000)
+        self._socket_timeout_spin.setSuffix(' ms')
+        self._socket_timeout_spin.setSpecialValueText('No timeout')
+        self._probe_result_label = QtWidgets.QLabel()
+        self._probe_result_label.setWordWrap(True)
+
+        self._save_button = QtWidgets.QPushButton('&Save profile')
+        self._delete_button = QtWidgets.QPushButton('&Delete profile')
+        self._probe_button = QtWidgets.QPushButton('&Probe')
+        self._ok_button = QtWidgets.QPushButton('&Connect')
+        self._ok_button.setDefault(True)
+        self._cancel_button = QtWidgets.QPushButton('C&ancel')
+
+        # layout
+        self._compressor_layout = QtWidgets.QHBoxLayout()
+        for c in ConnectionProfiles.ConnectionProfile.Compressors:
+            self._compressor_layout.addWidget(self._compressor_checkboxes[c])
+        self._compressor_layout.addStretch()
+
+        self._form_layout = QtWidgets.QFormLayout()
+        self._form_layout.addRow('Profile:',self._profile_combo)
+        self._form_layout.addRow('Name:',self._name_edit)
+        self._form_layout.addRow('Mongo URI:',self._uri_edit)
+        self._form_layout.addRow('Pool size:',self._pool_size_spin)
+        self._form_layout.addRow('Compression:',self._compressor_layout)
+        self._form_layout.addRow('Read preference:',self._read_preference_combo)
+        self._form_layout.addRow('Batch size:',self._batch_size_spin)
+        self._form_layout.addRow('Socket timeout:',self._socket_timeout_spin)
+        self._form_layout.addRow(self._probe_result_label)
+
+        self._button_layout = QtWidgets.QHBoxLayout()
+        self._button_layout.addWidget(self._save_button)
+        self._button_layout.addWidget(self._delete_button)
+        self._button_layout.addWidget(self._probe_button)
+        self._button_layout.addStretch()
+        self._button_layout.addWidget(self._ok_button)
+        self._button_layout.addWidget(self._cancel_button)
+
+        self._main_layout = QtWidgets.QVBoxLayout()
+        self._main_layout.addLayout(self._form_layout)
+        self._main_layout.addLayout(self._button_layout)
+        self.setLayout(self._main_layout)
+
+    def _update_profile_list(self,current_name):
+        self._profile_combo.clear()
+        names = ConnectionProfiles.ConnectionProfile.list_names(self._settings)
+        self._profile_combo.addItems(names)
+        if current_name in names:
+            self._profile_combo.setCurrentIndex(names.index(current_name))
+        self._delete_button.setEnabled(len(names) > 0)
+
+    def _show_profile(self,profile):
+        self._name_edit.setText(profile.name)
+        self._uri_edit.setText(profile.uri)
+        self._pool_size_spin.setValue(profile.max_pool_size)
+        compressors = profile.compressors.split(',')
+        for c,checkbox in self._compressor_checkboxes.items():
+            checkbox.setChecked(c in compressors)
+        index = self._read_preference_combo.findText(profile.read_preference)
+        self._read_preference_combo.setCurrentIndex(max(index,0))
+        self._batch_size_spin.setValue(profile.batch_size)
+        self._socket_timeout_spin.setValue(profile.socket_timeout)
+        self._probe_result_label.setText('')
+
+    def _slot_profile_selected(self,name):
+        self._show_profile(ConnectionProfiles.ConnectionProfile.load(self._settings,name))
+
+    def _slot_save_clicked(self):
+        profile = self.get_profile()
+        profile.save(self._settings)
+        self._update_profile_list(profile.name)
+
+    def _slot_delete_clicked(self):
+        name = self._profile_combo.currentText()
+        if name != '':
+            ConnectionProfiles.ConnectionProfile.remove(self._settings,name)
+            self._update_profile_list(None)
+
+    def _slot_probe_clicked(self):
+        self._probe_result_label.setText('Probing...')
+        QtWidgets.QApplication.setOverrideCursor(QtCore.Qt.WaitCursor)
+        try:
+            result = ConnectionProfiles.probe(self.get_profile())
+            self._probe_result_label.setText(result.describe())
+        except (pymongo.errors.PyMongoError,ValueError) as e:
+            self._probe_result_label.setText('Probe failed: ' + str(e))
+        finally:
+            QtWidgets.QApplication.restoreOverrideCursor()
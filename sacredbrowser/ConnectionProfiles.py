@@ -0,0 +1,138 @@
+# This file contains connection profiles, which hold the settings for a MongoDB connection (besides the URI):
+# pool size, wire compression, read preference, and the batch size for loading experiments. Profiles are saved
+# in the settings file. Each profile can be probed for latency and throughput, so that the best settings
+# for a site can be chosen.
+
+import bson.raw_bson
+import pymongo
+
+import time
+import statistics
+
+# Database connection timeout (ms)
+DbTimeout = 10000
+
+class ConnectionProfile:
+    # read preferences which are offered (secondaryPreferred is useful for browsing replica sets)
+    ReadPreferences = [ 'primary', 'primaryPreferred', 'secondary', 'secondaryPreferred', 'nearest' ]
+    Compressors = [ 'zstd', 'zlib', 'snappy' ]
+
+    def __init__(self,name='Default',uri='mongodb://localhost:27017',max_pool_size=100,compressors='',
+            read_preference='primary',batch_size=0,socket_timeout=DbTimeout):
+        self.name = name
+        self.uri = uri
+        self.max_pool_size = max_pool_size
+        self.compressors = compressors # comma-separated list, may be empty
+        self.read_preference = read_preference
+        self.batch_size = batch_size # 0 means the server default
+        self.socket_timeout = socket_timeout
+
+    # Returns keyword arguments for MongoClient
+    def client_options(self):
+        options = { 'maxPoolSize': self.max_pool_size, 'readPreference': self.read_preference, 'socketTimeoutMS': self.socket_timeout }
+        if self.compressors != '':
+            options['compressors'] = self.compressors
+        return options
+
+    def create_client(self,**extra_options):
+        options = self.client_options()
+        options.update(extra_options)
+        return pymongo.MongoClient(self.uri,**options)
+
+    # Apply the batch size to a cursor, returns the cursor
+    def apply_batch_size(self,cursor):
+        if self.batch_size > 0:
+            cursor.batch_size(self.batch_size)
+        return cursor
+
+    def describe(self):
+        return '%s (pool %d, compression %s, %s, batch size %s)' % (self.uri,self.max_pool_size,self.compressors or 'none',
+                self.read_preference,self.batch_size if self.batch_size > 0 else 'default')
+
+    ############# Persistence #############
+    SettingsGroup = 'ConnectionProfiles'
+    _Attributes = [ ('uri',str), ('max_pool_size',int), ('compressors',str), ('read_preference',str), ('batch_size',int), ('socket_timeout',int) ]
+
+    def save(self,settings):
+        for attr,tp in self._Attributes:
+            settings.setValue('%s/%s/%s' % (self.SettingsGroup,self.name,attr),getattr(self,attr))
+
+    @classmethod
+    def load(cls,settings,name):
+        profile = cls(name)
+        for attr,tp in cls._Attributes:
+            value = settings.value('%s/%s/%s' % (cls.SettingsGroup,name,attr))
+            if value is not None:
+                setattr(profile,attr,tp(value))
+        return profile
+
+    @classmethod
+    def remove(cls,settings,name):
+        settings.remove('%s/%s' % (cls.SettingsGroup,name))
+
+    @classmethod
+    def list_names(cls,settings):
+        settings.beginGroup(cls.SettingsGroup)
+        names = settings.childGroups()
+        settings.endGroup()
+        return sorted(names)
+
+# Result of probe()
+class ProbeResult:
+    def __init__(self,latency_ms,documents,bytes_read,seconds,collection):
+        self.latency_ms = latency_ms # median round trip time of a ping
+        self.documents = documents
+        self.bytes_read = bytes_read
+        self.seconds = seconds
+        self.collection = collection # name of the collection which was read, or None
+
+    def throughput(self):
+        return self.bytes_read / self.seconds if self.seconds > 0 else 0.0
+
+    def describe(self):
+        text = 'Round trip: %.1f ms' % self.latency_ms
+        if self.collection is not None:
+            text += ', read %d documents (%.1f kB) from %s in %.2f s: %.1f kB/s' % (self.documents,self.bytes_read / 1024,
+                    self.collection,self.seconds,self.throughput() / 1024)
+        return text
+
+# Measure the round trip time (median of ping_count pings) and the throughput (reading up to max_documents
+# documents from a runs collection, or from the given collection as (database, collection)) with the given profile.
+# Raises pymongo errors if the server cannot be reached.
+def probe(profile,collection=None,ping_count=5,max_documents=2000):
+    # the socket timeout of the profile may be 0 (no timeout), which must not apply to server selection
+    client = profile.create_client(document_class=bson.raw_bson.RawBSONDocument,serverSelectionTimeoutMS=DbTimeout)
+    try:
+        round_trips = []
+        for i in range(ping_count):
+            start = time.perf_counter()
+            client.admin.command('ping')
+            round_trips.append((time.perf_counter() - start) * 1000)
+
+        if collection is None:
+            collection = _find_runs_collection(client)
+        if collection is None:
+            return ProbeResult(statistics.median(round_trips),0,0,0.0,None)
+
+        documents = 0
+        bytes_read = 0
+        start = time.perf_counter()
+        cursor = profile.apply_batch_size(client[collection[0]][collection[1]].find().limit(max_documents))
+        for doc in cursor:
+            documents += 1
+            bytes_read += len(doc.raw)
+        seconds = time.perf_counter() - start
+
+        return ProbeResult(statistics.median(round_trips),documents,bytes_read,seconds,'%s.%s' % collection)
+    finally:
+        client.close()
+
+# find any collection with Sacred runs
+def _find_runs_collection(client):
+    for dbname in client.list_database_names():
+        if dbname in [ 'admin', 'local', 'config' ]:
+            continue
+        for cname in sorted(client[dbname].list_collection_names()):
+            if cname == 'runs' or cname.endswith('.runs'):
+                return (dbname,cname)
+    return None
@@ -9,6 +9,8 @@ from . import DbModel
 from . import StateModels
 from . import BrowserState
 from . import Utilities
+from . import StudyWatcher
+from . import Config
 
 from PyQt5 import QtCore, QtGui, QtWidgets
 
@@ -24,6 +26,9 @@ class DbController(QtCore.QObject):
         self._sorted_experiment_list = sorted_experiment_list
         self._connection = connection
 
+        # live updates of the current study, if enabled
+        self._study_watcher = None
+
         self._create_models()
 
         # Now everything is built. 
@@ -64,7 +69,10 @@ class DbController(QtCore.QObject):
     def _create_models(self):
         # TODO I don't think this belongs to the controller
         self._study_tree_model = DbModel.StudyTreeModel(self._connection)
-        self._experiment_list_model = DbModel.ExperimentListModel(self._browser_state,self._sorted_experiment_list)
+        if Config.UsePagedExperimentList:
+            self._experiment_list_model = DbModel.PagedExperimentListModel(self._browser_state)
+        else:
+            self._experiment_list_model = DbModel.ExperimentListModel(self._browser_state,self._sorted_experiment_list)
         self._invisible_fields_model = StateModels.InvisibleFieldsModel(self._browser_state.fields)
         self._visible_fields_model = StateModels.VisibleFieldsModel(self._browser_state.fields)
 
@@ -108,8 +116,12 @@ class DbController(QtCore.QObject):
         raise Exception('not implemented')
 
     def delete_experiments(self,ob_ids):
-        self._browser_state.current_study.get_study().delete_experiments_from_database(ob_ids)
-        self._browser_state.current_study.get_study().load_full()
+        study = self._browser_state.current_study.get_study()
+        study.delete_experiments_from_database(ob_ids)
+        if study.is_paged():
+            self._experiment_list_model.reload()
+        else:
+            study.load_incremental()
         
     def delete_database(self,database_item):
         super_connection = database_item.get_connection()
@@ -201,12 +213,19 @@ class DbController(QtCore.QObject):
     ################## Slots to be called from the state holders and database objects ##################
     def slot_study_to_be_changed(self,study):
         print('Db Controller: slot_study_to_be_changed called')
-        pass
+        if self._study_watcher is not None:
+            self._study_watcher.stop()
+            self._study_watcher.deleteLater()
+            self._study_watcher = None
 
     def slot_study_changed(self,study):
         print('Db Controller: slot_study_changed called')
         # activate controls
         self._main_win.enable_study_controls(study is not None)
+
+        if study is not None and Config.WatchStudies:
+            self._study_watcher = StudyWatcher.StudyWatcher(study,self)
+            self._study_watcher.start()
     
     def slot_experiment_list_changed(self):
         # This is called when the list of experiments has been reloaded
@@ -240,13 +259,18 @@ class DbController(QtCore.QObject):
     def slot_new_filter(self,filter_text,filter_dict):
         study = self._browser_state.current_study.get_study()
         if study is not None:
+            if study.is_loading() and filter_dict == study.get_filter():
+                return # already being loaded with this filter
             study.set_filter(filter_dict)
-            study.load_full()
+            if study.is_paged():
+                self._experiment_list_model.reload()
+            else:
+                study.load_in_background()
 
     ################## Internal functionality ##################
     def _on_select_database(self,database):
         # TODO reload?
-        database.load_if_uninitialized()
+        database.load_in_background_if_uninitialized()
         # this creates all signals to update views (I hope)
 
          
@@ -255,5 +279,17 @@ class DbController(QtCore.QObject):
 #         # TODO reload?
 #         study.load_if_uninitialized()
 
+        # The background loader runs one job after the other, so a running load of the previous study would delay
+        # this one. The previous study is loaded again when it is selected again.
+        old_study = self._browser_state.current_study.get_study()
+        if old_study is not None and old_study is not study:
+            old_study.cancel_background_load()
+
+        # Start loading before the study becomes current, so that nobody triggers a synchronous load. If the
+        # saved filter of the study differs from the current one, the load is restarted by slot_new_filter.
+        # In paged mode, the experiment list model loads what it needs.
+        study.set_paged(Config.UsePagedExperimentList)
+        if not study.is_paged():
+            study.load_in_background()
         self._browser_state.current_study.set_study(study)
 
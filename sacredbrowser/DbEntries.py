@@ -18,22 +18,36 @@
 
 from . import BrowserState 
 from . import Utilities
+from . import BackgroundLoader
+from . import SkeletonCache
+from . import FieldIndex
+from . import ColumnStore
+from . import FileCache
+from . import ConnectionProfiles
+from . import StudyStatistics
+from . import Config
 
 from PyQt5 import QtCore
 
 import pymongo
+import concurrent.futures
 import time
 import enum
 import re
 import collections
+import numbers
+import datetime
+import sys
 import gridfs
+import bson
+import os
 # 
 # # TODO REMOVE
 ChangeType = Utilities.ChangeType
 ChangeData = Utilities.ChangeData
 
-# Database connection timeout (ms)
-DbTimeout = 10000
+# Number of experiment skeletons which are transferred from the background loader at once
+LoadBatchSize = 1000
 
 # These classes are used to signal data changes to the model. The info parameter should be
 # - None in the case of Reset
@@ -42,19 +56,171 @@ DbTimeout = 10000
 #   means that insert was performed at the end
 # - (position, count) in the case of delete (position is the first row deleted)
 
+# Projection which loads the skeleton of an experiment (see SacredExperiment.load_skeleton)
+SkeletonProjection = {'_id': 1, 'config': 1, 'result': 1, 'status': 1, 'heartbeat': 1}
+# Projection which is sufficient to decide whether a loaded experiment is outdated (see SacredStudy.load_incremental)
+FreshnessProjection = {'_id': 1, 'status': 1, 'heartbeat': 1}
+
 # Helper functions for experiments
+# Note that field names are interned, since they are shared between many experiments. The dotted names are
+# built only once: _field_names maps each prefix (None at the top level) to a dictionary key -> dotted name.
+# Flattened configs are deliberately not cached by content (e.g. keyed by a canonical hash of the config): computing
+# the key walks the config just like flattening does, and the values are copied into the column store anyway, so
+# such a cache neither saves time nor memory, even in seed sweeps.
 def parse_config(cfgDict):
-    def recursively_flatten_dict(prefix,dct):
-        result = {}
-        for key,val in dct.items():
-            this_prefix = prefix + '.' + key if prefix != '' else key
-            if type(val) is dict:
-                result.update(recursively_flatten_dict(this_prefix,val))
-            else:
-                result[this_prefix] = val
-        return result
-  
-    return recursively_flatten_dict('',cfgDict)
+    if len(_field_names) > Config.FieldNameCacheSize:
+        _field_names.clear()
+    result = {}
+    _flatten_into(result,None,cfgDict)
+    return result
+
+_field_names = {}
+
+def _flatten_into(result,prefix,dct):
+    names = _field_names.get(prefix)
+    if names is None:
+        names = _field_names[prefix] = {}
+    for key,val in dct.items():
+        name = names.get(key)
+        if name is None:
+            name = names[key] = sys.intern(prefix + '.' + key if prefix is not None else key)
+        if type(val) is dict:
+            _flatten_into(result,name,val)
+        else:
+            result[name] = val
+
+# Map a field (see BrowserState.Fields) to the corresponding path in a database document, 
+# as far as possible. Returns None if the field cannot be mapped.
+# Result fields are mapped according to result_types, the ways in which the experiments store their results
+# (see load_result_types): list indices are zero-padded in field names (see parse_result), but not in paths,
+# whereas dictionary keys are kept as they are. If the layouts disagree about a key, it cannot be mapped.
+def mongo_path_for_field(field,result_types):
+    if field[0] == BrowserState.Fields.FieldType.Config:
+        return 'config.' + field[1]
+    elif field[0] == BrowserState.Fields.FieldType.Result:
+        # inverse of parse_result
+        match = re.match(r'^Result (.+)$',field[1])
+        if match is None:
+            return None
+        key = match.groups()[0]
+        is_index = re.match(r'^[0-9]+$',key) is not None
+        if 'tuple' in result_types:
+            if len(result_types) > 1 or not is_index:
+                return None
+            return 'result.py/tuple.' + str(int(key))
+        if is_index and str(int(key)) != key:
+            if 'list' in result_types and 'dict' in result_types:
+                return None
+            if 'list' in result_types:
+                key = str(int(key))
+        return 'result.' + key
+    else:
+        return None
+
+# Returns the ways in which the experiments matching flt store their results (see parse_result), as a set
+# containing 'list', 'tuple', and/or 'dict'
+def load_result_types(collection,flt):
+    type_queries = {
+        'list': { 'result': { '$type': 'array' } },
+        'tuple': { 'result.py/tuple': { '$exists': True } },
+        'dict': { 'result': { '$type': 'object' }, 'result.py/tuple': { '$exists': False } },
+    }
+    result_types = set()
+    for result_type,query in type_queries.items():
+        if len(flt) > 0:
+            query = { '$and': [ flt, query ] }
+        if len(list(collection.find(query,projection={ '_id': 1 }).limit(1))) > 0:
+            result_types.add(result_type)
+    return result_types
+
+# Get the value at a dotted path (e.g. as returned by mongo_path_for_field) from a database document,
+# or None if there is no such value.
+def get_path_value(doc,path):
+    val = doc
+    for part in path.split('.'):
+        if type(val) is dict and part in val:
+            val = val[part]
+        elif type(val) is list and re.match(r'^[0-9]+$',part) and int(part) < len(val):
+            val = val[int(part)]
+        else:
+            return None
+    return val
+
+# Aggregation pipeline which returns the flattened config keys (as _id) of all experiments matching
+# flt, see parse_config. Nested dictionaries are flattened up to max_depth levels.
+def make_config_fields_pipeline(flt,max_depth):
+    pipeline = [
+        { '$match': flt },
+        { '$project': { '_id': 0, 'k': { '$literal': '' }, 'v': '$config' } },
+    ]
+    for level in range(max_depth):
+        is_object = { '$eq': [ { '$type': '$v' }, 'object' ] }
+        pipeline += [
+            { '$project': { 'k': 1, 'leaf': { '$not': [ is_object ] }, 'sub': { '$objectToArray': { '$cond': [ is_object, '$v', {} ] } } } },
+            { '$unwind': { 'path': '$sub', 'preserveNullAndEmptyArrays': True } },
+            # empty dictionaries vanish, like in parse_config
+            { '$match': { '$or': [ { 'leaf': True }, { 'sub': { '$exists': True } } ] } },
+            { '$project': { 
+                'k': { '$cond': [ '$leaf', '$k', { '$cond': [ { '$eq': [ '$k', '' ] }, '$sub.k', { '$concat': [ '$k', '.', '$sub.k' ] } ] } ] },
+                'v': { '$cond': [ '$leaf', None, '$sub.v' ] } } },
+        ]
+    pipeline += [
+        { '$group': { '_id': '$k' } },
+        { '$match': { '_id': { '$ne': '' } } },
+    ]
+    return pipeline
+
+# Aggregation pipeline which returns the distinct layouts of the results of all experiments matching flt,
+# as _id: {'len': length of list or py/tuple result, 'keys': keys of dictionary result}
+def make_result_layouts_pipeline(flt):
+    return [
+        { '$match': flt },
+        { '$project': { '_id': 0,
+            'len': { '$switch': { 'branches': [
+                { 'case': { '$eq': [ { '$type': '$result' }, 'array' ] }, 'then': { '$size': '$result' } },
+                { 'case': { '$eq': [ { '$type': '$result.py/tuple' }, 'array' ] }, 'then': { '$size': '$result.py/tuple' } } ],
+                'default': None } },
+            'keys': { '$cond': [ { '$eq': [ { '$type': '$result' }, 'object' ] },
+                { '$map': { 'input': { '$objectToArray': '$result' }, 'in': '$$this.k' } }, None ] } } },
+        { '$group': { '_id': { 'len': '$len', 'keys': '$keys' } } },
+    ]
+
+# Convert result layouts (see make_result_layouts_pipeline) to result field names, consistent with parse_result
+def result_fields_from_layouts(layouts):
+    result_fields = set()
+    for layout in layouts:
+        if layout.get('len') is not None:
+            result_fields.update(parse_result([ None ] * layout['len']).keys())
+        elif layout.get('keys') is not None:
+            result_fields.update(parse_result({ k: None for k in layout['keys'] }).keys())
+    return result_fields
+
+# Returns the shape in the given column store of an experiment with the given flattened config and result field
+# names. Shapes are cached by the field names (in the store), so that experiments with the same key layout do not
+# create any new fields.
+def get_field_shape(column_store,config_keys,result_keys):
+    make_fields = lambda: tuple((BrowserState.Fields.FieldType.Config,k) for k in config_keys) + tuple((BrowserState.Fields.FieldType.Result,k) for k in result_keys)
+    return column_store.get_shape_by_key((config_keys,result_keys),make_fields)
+
+# Parse a document which was loaded with SkeletonProjection. Returns the skeleton in the format used by the
+# skeleton cache: (config dict, result dict, status, heartbeat). May be called on the worker thread.
+def parse_skeleton(exp_dict):
+    config_dict = parse_config(exp_dict['config']) if 'config' in exp_dict else {}
+    result_dict = parse_result(exp_dict['result']) if 'result' in exp_dict else {}
+    status = exp_dict['status'] if 'status' in exp_dict else 'UNKNOWN'
+    return (config_dict,result_dict,status,exp_dict.get('heartbeat'))
+
+# Generator for the skeleton documents (see SkeletonProjection) of the experiments with the given _ids which match
+# the filter. The _ids are queried in chunks of the batch size of the connection profile (or LoadBatchSize), so
+# that a single query never exceeds the maximum document size of the server. Suitable for fetchers.
+def find_skeletons_by_id(collection,flt,obids,profile):
+    chunk_size = profile.batch_size if profile.batch_size > 0 else LoadBatchSize
+    obids = list(obids)
+    for start in range(0,len(obids),chunk_size):
+        query = { '_id': { '$in': obids[start:start + chunk_size] } }
+        if len(flt) > 0:
+            query = { '$and': [ flt, query ] }
+        yield from profile.apply_batch_size(collection.find(query,projection=SkeletonProjection))
 
 def parse_result(result):
     def parse_list(l):
@@ -62,7 +228,7 @@ def parse_result(result):
             template = 'Result %d'
         else:
             template = 'Result %02d'
-        return { template % pos: val for pos,val in enumerate(l) }
+        return { sys.intern(template % pos): val for pos,val in enumerate(l) }
 
     if type(result) is list:
         result_dict = parse_list(result)
@@ -71,7 +237,7 @@ def parse_result(result):
         if 'py/tuple' in result:
             result_dict = parse_list(result['py/tuple'])
         else:
-            result_dict = { 'Result %s' % k:v for k,v in result.items() } # TODO?
+            result_dict = { sys.intern('Result %s' % k):v for k,v in result.items() } # TODO?
     else:
         print('Cannot interpret result of type',type(result))
         result_dict = {}
@@ -89,10 +255,16 @@ def parse_result(result):
 #
 # All this functionality must be implemented in the subclasses!
 #
+# Alternatively, objects can be loaded in the background (load_in_background): the database is queried
+# on the worker thread of the BackgroundLoader, and the results are applied on the main thread. While such
+# a load is running, is_loading() returns True and load_if_uninitialized does nothing. When it is done,
+# load_finished is emitted.
+#
 # Most objects keep their children in an ObjectHolder, which implements common useful
 # functionality. Objects should (often via the ObjectHolder) emit suitable signals
 # whenever their content has changed.
 class AbstractDbEntry(QtCore.QObject):
+    load_finished = QtCore.pyqtSignal(object)
 
     ############### General interface ###############
     # Constructor. Note that after the constructor call, load_skeleton should be called.
@@ -101,6 +273,11 @@ class AbstractDbEntry(QtCore.QObject):
         self._init_timestamp = time.time()
         self._load_timestamp = None
 
+        # background loading: results of outdated loads are discarded by comparing the generation
+        self._loading = False
+        self._refreshing = False
+        self._load_generation = 0
+
     def name(self):
         pass
 
@@ -127,18 +304,76 @@ class AbstractDbEntry(QtCore.QObject):
     def load_full(self):
         raise Exception('This function must not be called directly')
 
+    def load_in_background(self):
+        raise Exception('This function must not be called directly')
+
     def is_initialized(self):
         return self._load_timestamp is not None
 
+    def is_loading(self):
+        return self._loading
+
+    # True while changes of a loaded object are being loaded in the background (see _start_background_load)
+    def is_refreshing(self):
+        return self._refreshing
+
     def load_if_uninitialized(self):
-        if not self.is_initialized():
+        if not self.is_initialized() and not self.is_loading():
             self.load_full()
 
+    def load_in_background_if_uninitialized(self):
+        if not self.is_initialized() and not self.is_loading():
+            self.load_in_background()
+
+    # Discard the results of a running background load, which stops after its next result (e.g. when the object
+    # is no longer shown). The object may then be partially loaded, so it must be reloaded when it is needed again.
+    def cancel_background_load(self):
+        if self._loading or self._refreshing:
+            self._load_generation += 1
+            self._loading = False
+            self._refreshing = False
+
     def delete(self):
         # debug
         print('Deleting object with id',self.qualified_id())
+        self._load_generation += 1 # discard running background loads
+        self._loading = False
+        self._refreshing = False
         self.deleteLater()
 
+    # Helper for load_in_background: submits fetcher, receiver, and finisher (which may be None) to the
+    # background loader (see there), discarding the results of any previous background load.
+    # If refresh is set, only the changes of an object which is already loaded are loaded: the object remains
+    # complete in the meantime, so is_refreshing() returns True instead of is_loading().
+    def _start_background_load(self,fetcher,receiver,finisher=None,refresh=False):
+        self._load_generation += 1
+        generation = self._load_generation
+        self._loading = not refresh
+        self._refreshing = refresh
+
+        def checked_fetcher():
+            for result in fetcher():
+                yield result
+                if generation != self._load_generation:
+                    return # abandon outdated load
+
+        def checked_receiver(result):
+            if generation == self._load_generation:
+                receiver(result)
+
+        def checked_finisher(error):
+            if generation != self._load_generation:
+                return
+            self._loading = False
+            self._refreshing = False
+            if error is not None:
+                print('Error loading %s in background: %s' % (self.qualified_id(),str(error)))
+            if finisher is not None:
+                finisher(error)
+            self.load_finished.emit(self)
+
+        BackgroundLoader.get_background_loader().submit(checked_fetcher,checked_receiver,checked_finisher)
+
 # Singleton connection object, main functionality: connect().
 # Holds a list of databases (in an ObjectHolder).
 class SacredConnection(AbstractDbEntry):
@@ -154,6 +389,7 @@ class SacredConnection(AbstractDbEntry):
         assert self.singleton is None
         super().__init__(parent)
         self._uri = None
+        self._profile = ConnectionProfiles.ConnectionProfile()
         self._mongo_client = None
 
         # lazily loaded databases
@@ -179,15 +415,19 @@ class SacredConnection(AbstractDbEntry):
     def load_full(self):
         # if the connection is not established, must possibly remove old databases!
         if self._mongo_client is None:
-            new_keys = []
+            self._apply_database_names([])
         else:
-            new_keys = sorted([ (self._uri,x) for x in self._mongo_client.database_names() ])
+            for result in self._make_population_fetcher()():
+                self._receive_population_result(result)
 
-        self._load_timestamp = time.time()
-
-        self._databases.update(new_keys)
+    # Loads the database names, and then the collection names of all databases (in parallel), so that the
+    # whole study tree is populated at once
+    def load_in_background(self):
+        if self._mongo_client is None:
+            self._apply_database_names([])
+            return
 
-        self._databases.forall(lambda x: x.load_skeleton())
+        self._start_background_load(self._make_population_fetcher(),self._receive_population_result)
 
     def delete(self):
         # should not actually happen
@@ -197,29 +437,90 @@ class SacredConnection(AbstractDbEntry):
         super().delete()
 
     ############# Specific Interface #############
-    def connect(self,uri):
-        if uri != self._uri:
+    # Connect to the given URI, with the settings from the given profile (see ConnectionProfiles), or
+    # with default settings
+    def connect(self,uri,profile=None):
+        if uri != self._uri or profile is not None:
             self._uri = uri
+            self._profile = profile if profile is not None else ConnectionProfiles.ConnectionProfile(uri=uri)
             if uri != None:
-                self._mongo_client = pymongo.mongo_client.MongoClient(uri,socketTimeoutMS=DbTimeout) 
+                self._mongo_client = pymongo.mongo_client.MongoClient(uri,**self._profile.client_options())
             else:
                 self._mongo_client = None
             # TODO error handling!
 
         # in either case, reload (should never do any harm, except cause a bit of delay)
-        self.load_full()
+        self.load_in_background()
 
     def get_mongo_client(self):
         return self._mongo_client
 
+    def get_profile(self):
+        return self._profile
+
     def list_databases(self):
         self.load_if_uninitialized()
         return [x[1] for x in self._databases.list_keys()]
 
+    # Constant-time accessors for models, which do not copy the list of databases
+    def count_databases(self):
+        self.load_if_uninitialized()
+        return self._databases.count()
+
+    def get_database_at(self,row):
+        self.load_if_uninitialized()
+        return self._databases.get_by_position(row)[1]
+
+    # Raises a ValueError if there is no such database
+    def get_database_row(self,name):
+        self.load_if_uninitialized()
+        return self._databases.get_position((self._uri,name))
+
     def get_database(self,name):
         self.load_if_uninitialized()
         return self._databases.get_by_key((self._uri,name))[1]
 
+    ############# Internals #############
+    # Returns a fetcher which yields ('databases', database names), and then ('collections', (database name,
+    # collection names)) for each database, as soon as the collections are known. The collections of
+    # Config.StudyTreeThreadCount databases are listed at the same time.
+    def _make_population_fetcher(self):
+        mongo_client = self._mongo_client
+        def fetcher():
+            database_names = mongo_client.list_database_names()
+            yield ('databases',database_names)
+            with concurrent.futures.ThreadPoolExecutor(Config.StudyTreeThreadCount) as executor:
+                futures = { executor.submit(mongo_client[dbname].list_collection_names): dbname for dbname in database_names }
+                for future in concurrent.futures.as_completed(futures):
+                    try:
+                        yield ('collections',(futures[future],future.result()))
+                    except pymongo.errors.PyMongoError as e:
+                        # e.g. not authorized, the database is then loaded when it is selected
+                        print('Could not list collections of database %s: %s' % (futures[future],str(e)))
+        return fetcher
+
+    def _receive_population_result(self,result):
+        tp,data = result
+        if tp == 'databases':
+            self._apply_database_names(data)
+        else:
+            dbname,collection_names = data
+            key = (self._uri,dbname)
+            if self._databases.has_key(key):
+                database = self._databases.get_by_key(key)[1]
+                if not database.is_loading():
+                    database.apply_collection_names(collection_names)
+
+    def _apply_database_names(self,database_names):
+        new_keys = sorted([ (self._uri,x) for x in database_names ])
+
+        self._load_timestamp = time.time()
+
+        self._databases.update(new_keys)
+
+        self._databases.forall(lambda x: x.load_skeleton())
+
+    ############# Specific Interface #############
     def delete_database(self,dbname):
         # first delete the database object, which avoids dangling references
         keylist = self._databases.list_keys()
@@ -273,8 +574,17 @@ class SacredDatabase(AbstractDbEntry):
         pass # no skeleton
 
     def load_full(self):
+        self._apply_collection_names(self._mongo_database.list_collection_names())
+
+    def load_in_background(self):
+        mongo_database = self._mongo_database
+        def fetcher():
+            yield mongo_database.list_collection_names()
+        self._start_background_load(fetcher,self._apply_collection_names)
+
+    def _apply_collection_names(self,collection_names):
         # Prepare the assignment of mongo collections to studies
-        self._load_study_info()
+        self._load_study_info(collection_names)
 
         new_keys = sorted(self._study_info_dict.keys())
 
@@ -306,8 +616,8 @@ class SacredDatabase(AbstractDbEntry):
     ############# Specific Interface #############
     # The database manages the assignment of study names to the underlying collections, as a proxy for
     # the object holder.
-    def _load_study_info(self):
-        new_collections = list(self._mongo_database.collection_names())
+    def _load_study_info(self,collection_names):
+        new_collections = list(collection_names)
         study_info_list = self._get_study_info_from_collection_names(new_collections)
         self._study_info_dict = { x[0]: x for x in study_info_list }
 
@@ -324,10 +634,29 @@ class SacredDatabase(AbstractDbEntry):
         self.load_if_uninitialized()
         return self._studies.list_keys()
 
+    # Constant-time accessors for models, which do not copy the list of studies
+    def count_studies(self):
+        self.load_if_uninitialized()
+        return self._studies.count()
+
+    def get_study_at(self,row):
+        self.load_if_uninitialized()
+        return self._studies.get_by_position(row)[1]
+
+    # Raises a ValueError if there is no such study
+    def get_study_row(self,name):
+        self.load_if_uninitialized()
+        return self._studies.get_position(name)
+
     def get_study(self,name):
         self.load_if_uninitialized()
         return self._studies.get_by_key(name)[1]
 
+    # Signal that the given study has changed (e.g. its statistics), so that views are updated
+    def notify_study_changed(self,study):
+        if study.id() in self._study_info_dict:
+            self._studies.notify_content_changed([study.id()])
+
     def get_filesystem(self,root_collection):
         if root_collection in self._filesystems:
             return self._filesystems[root_collection]
@@ -353,6 +682,9 @@ class SacredDatabase(AbstractDbEntry):
         # now delete study
 # # # # # # #         self._mongo_client.drop_database(dbname)
         study._mongo_runs_collection.drop()
+        cache = SkeletonCache.get_skeleton_cache()
+        if cache is not None:
+            cache.clear_study(study.qualified_id())
         if study._filesystem is not None and not study._grid_fs_shared:
             self.delete_filesystem(study._grid_root)
 #         self.load_full()
@@ -413,6 +745,8 @@ class SacredDatabase(AbstractDbEntry):
 class SacredStudy(AbstractDbEntry):
     experiments_to_be_changed = QtCore.pyqtSignal(object,ChangeData)
     experiments_changed = QtCore.pyqtSignal(object,ChangeData)
+    fields_discovered = QtCore.pyqtSignal(object)
+    fields_changed = QtCore.pyqtSignal(object,list,list) # study, appeared fields, vanished fields
     object_to_be_deleted  = QtCore.pyqtSignal(object)
 
     ############# General Interface #############
@@ -427,14 +761,28 @@ class SacredStudy(AbstractDbEntry):
         self._mongo_runs_collection = self._database.get_mongo_database()[self._runs_name]
         self._filesystem = None
 
-        # lazily loaded experiments
+        # lazily loaded experiments, their fields are kept in the field index, and their values in the column store
         self._filter = {}
+        self._field_index = FieldIndex.FieldIndex()
+        self._column_store = ColumnStore.ColumnStore()
         pre_change_emit = lambda cd: self.experiments_to_be_changed.emit(self,cd)
         post_change_emit = lambda cd: self.experiments_changed.emit(self,cd)
-        loader = lambda obid: SacredExperiment(self,obid,self)
+        loader = lambda obid: SacredExperiment(self,obid,cached_skeleton=self._pending_skeletons.get(obid))
         deleter = lambda ob: ob.delete()
         self._experiments = Utilities.ObjectHolder(pre_change_emit=pre_change_emit,post_change_emit=post_change_emit,loader=loader,deleter=deleter)
 
+        # parsed skeletons (see parse_skeleton) from the current bulk load or from the skeleton cache, consumed by the loader
+        self._pending_skeletons = {}
+        # keys received so far by the current background load
+        self._background_keys = []
+        # in paged mode (see set_paged), experiments are not held in memory
+        self._paged = False
+        self._paged_state = None
+        # fields discovered by the server, as (config fields, result fields), indexed by the filter (see _get_filter_key),
+        # and the filters for which discovery is running
+        self._discovered_fields = {}
+        self._pending_discoveries = set()
+
         self.load_skeleton()
 
     def name(self):
@@ -448,22 +796,211 @@ class SacredStudy(AbstractDbEntry):
 
     def load_full(self):
 #         print('---> Call to SacredStudy.load_full, active filter',self._filter)
-        new_experiments = self._mongo_runs_collection.find(self._filter,projection={'_id': 1})
-        new_keys = sorted([x['_id'] for x in new_experiments if '_id' in x and x['_id'] is not None])
+        # A single cursor delivers the skeletons of all experiments, which are then handed to the
+        # new experiments (via the loader) and to the existing ones (via set_parsed_skeleton).
+        new_experiments = self._get_profile().apply_batch_size(self._mongo_runs_collection.find(self._filter,projection=SkeletonProjection))
+        skeletons = { x['_id']: parse_skeleton(x) for x in new_experiments if '_id' in x and x['_id'] is not None }
+        new_keys = sorted(skeletons.keys())
+        self._make_skeleton_cache_writer()(skeletons,set(self._experiments.list_keys()) - set(new_keys))
 
         self._load_timestamp = time.time()
 
-        self._experiments.update(new_keys)
+        self._apply_skeleton_delta(new_keys,skeletons)
 
-        self._experiments.forall(lambda x: x.load_skeleton())
+        self._load_filesystem()
 
-        # obtain GRIDFS file system
-        if self._grid_root is not None:
-            self._filesystem = self._database.get_filesystem(self._grid_root) # will not load filesystem twice
+    # Background version of load_full. The skeletons are loaded in order of their _id and applied in batches,
+    # so that rows appear while the cursor is drained. Experiments which are already present remain visible 
+    # (and are updated) until it is clear that they have vanished.
+    # If the study has not been loaded yet (and no filter is set), it is populated from the skeleton cache
+    # if possible, and only the changes are loaded in the background (as in load_incremental).
+    def load_in_background(self):
+        if not self.is_initialized() and len(self._filter) == 0 and self._load_from_skeleton_cache():
+            fetcher = self._make_incremental_fetcher()
+            self._start_background_load(fetcher,self._apply_incremental_result)
+            return
+
+        # Let the server find the fields first, so that they are known before all experiments have been loaded.
+        # Fields discovered earlier may be outdated, they must not be used while this load is running.
+        self._discovered_fields.clear()
+        if not self.is_initialized():
+            self.discover_fields_in_background()
+
+        self._background_keys = []
+        self._start_background_load(self._make_skeleton_fetcher(),self._receive_skeleton_batch,self._finish_background_load)
+
+    # Fetcher for the parsed skeletons of all experiments, in batches of LoadBatchSize (as ordered dictionaries
+    # from _id to skeleton) and in order of their _id. The skeleton cache is updated by the fetcher.
+    def _make_skeleton_fetcher(self):
+        collection = self._mongo_runs_collection
+        flt = self._filter
+        profile = self._get_profile()
+        known_keys = set(self._experiments.list_keys())
+        write_cache = self._make_skeleton_cache_writer()
+        def fetcher():
+            received_keys = set()
+            batch = {}
+            for exp_dict in profile.apply_batch_size(collection.find(flt,projection=SkeletonProjection).sort('_id',pymongo.ASCENDING)):
+                if '_id' in exp_dict and exp_dict['_id'] is not None:
+                    batch[exp_dict['_id']] = parse_skeleton(exp_dict)
+                if len(batch) >= LoadBatchSize:
+                    write_cache(batch,[])
+                    received_keys.update(batch.keys())
+                    yield batch
+                    batch = {}
+            write_cache(batch,known_keys - received_keys - set(batch.keys()))
+            if len(batch) > 0:
+                yield batch
+        return fetcher
+
+    def _receive_skeleton_batch(self,batch):
+        self._background_keys.extend(batch.keys())
+        # keys up to the last received one are final, any other existing experiments are kept for now
+        last_key = self._background_keys[-1]
+        new_keys = self._background_keys + [ k for k in self._experiments.list_keys() if k > last_key ]
+
+        self._load_timestamp = time.time()
+
+        self._apply_skeleton_delta(new_keys,batch)
+
+    def _finish_background_load(self,error):
+        if error is None:
+            # remove all experiments which have not been received
+            self._load_timestamp = time.time()
+            self._experiments.update(self._background_keys)
+            self._emit_field_changes()
+        self._background_keys = []
+
+        self._load_filesystem()
+
+    # Incremental version of load_full: only the _id, status and heartbeat of each experiment are scanned, and
+    # skeletons are only loaded for experiments which are new, or whose status or heartbeat has changed.
+    # Experiments which have vanished are removed. Changed experiments are signalled as content changes.
+    def load_incremental(self):
+        if self._paged:
+            self._check_paged_state()
+            return
+
+        if not self.is_initialized():
+            self.load_full()
+            return
+
+        fetcher = self._make_incremental_fetcher()
+        for result in fetcher():
+            self._apply_incremental_result(result)
+
+    # Background version of load_incremental, the changes are applied when they arrive (see
+    # _start_background_load, the study is refreshing in the meantime)
+    def load_incremental_in_background(self):
+        if self._paged:
+            self._start_background_load(self._make_paged_state_fetcher(),self._apply_paged_state,refresh=True)
+            return
+
+        if not self.is_initialized():
+            self.load_in_background()
+            return
+
+        self._start_background_load(self._make_incremental_fetcher(),self._apply_incremental_result,refresh=True)
+
+    # Returns a fetcher (suitable for the background loader) which yields the result of an incremental load
+    # as (current keys, parsed skeletons of new or changed experiments). The skeleton cache is updated by the fetcher.
+    def _make_incremental_fetcher(self):
+        collection = self._mongo_runs_collection
+        flt = self._filter
+        known_state = {}
+        for obid in self._experiments.list_keys():
+            exp = self._experiments.get_by_key(obid)[1]
+            known_state[obid] = (exp.get_status(),exp.get_heartbeat())
+        profile = self._get_profile()
+        write_cache = self._make_skeleton_cache_writer()
+
+        def fetcher():
+            current_keys = []
+            changed_keys = []
+            for x in profile.apply_batch_size(collection.find(flt,projection=FreshnessProjection)):
+                if '_id' not in x or x['_id'] is None:
+                    continue
+                current_keys.append(x['_id'])
+                if known_state.get(x['_id']) != (x.get('status','UNKNOWN'),x.get('heartbeat')):
+                    changed_keys.append(x['_id'])
+            current_keys.sort()
+
+            delta_experiments = find_skeletons_by_id(collection,flt,changed_keys,profile)
+            skeletons = { x['_id']: parse_skeleton(x) for x in delta_experiments if '_id' in x and x['_id'] is not None }
+
+            # experiments which were deleted between the two queries are skipped
+            current_keys = [ k for k in current_keys if k in known_state or k in skeletons ]
+            current_key_set = set(current_keys)
+            write_cache(skeletons,[ k for k in known_state if k not in current_key_set ])
+            yield (current_keys,skeletons)
+
+        return fetcher
+
+    def _apply_incremental_result(self,result):
+        current_keys,skeletons = result
+
+        self._load_timestamp = time.time()
+
+        self._apply_skeleton_delta(current_keys,skeletons)
+
+    # Reload the skeletons of the given experiments only (e.g. after a change notification from the
+    # database). Experiments which no longer exist or no longer match the filter are removed, new ones are added.
+    def refresh_experiments(self,obids):
+        if self._paged:
+            self._notify_paged_change()
+            self.discover_fields_in_background(refresh=True)
+            return
+
+        if not self.is_initialized():
+            return # nothing to refresh, the next load will get everything
+
+        for result in self._make_refresh_fetcher(obids)():
+            self._apply_refresh_result(result)
+
+    # Background version of refresh_experiments (the study is refreshing in the meantime)
+    def refresh_experiments_in_background(self,obids):
+        if self._paged:
+            self._notify_paged_change()
+            self.discover_fields_in_background(refresh=True)
+            return
+
+        if not self.is_initialized():
+            return # nothing to refresh, the next load will get everything
+
+        self._start_background_load(self._make_refresh_fetcher(obids),self._apply_refresh_result,refresh=True)
+
+    # Returns a fetcher (suitable for the background loader) which yields the refreshed experiments as
+    # (requested _ids, parsed skeletons of those which still match the filter). The skeleton cache is updated
+    # by the fetcher.
+    def _make_refresh_fetcher(self,obids):
+        collection = self._mongo_runs_collection
+        flt = self._filter
+        obids = set(obids)
+        profile = self._get_profile()
+        write_cache = self._make_skeleton_cache_writer()
+
+        def fetcher():
+            refreshed_experiments = find_skeletons_by_id(collection,flt,obids,profile)
+            skeletons = { x['_id']: parse_skeleton(x) for x in refreshed_experiments if '_id' in x and x['_id'] is not None }
+            write_cache(skeletons,[ k for k in obids if k not in skeletons ])
+            yield (obids,skeletons)
+        return fetcher
+
+    def _apply_refresh_result(self,result):
+        obids,skeletons = result
+
+        known_keys = self._experiments.list_keys()
+        known_key_set = set(known_keys)
+        current_keys = [ k for k in known_keys if k not in obids or k in skeletons ]
+        current_keys.extend(k for k in skeletons.keys() if k not in known_key_set)
+
+        self._apply_skeleton_delta(sorted(current_keys),skeletons)
 
     def delete(self):
         # delete children automatically
         self._experiments.update([])
+        self._field_index.take_changes()
+        StudyStatistics.get_statistics_cache().invalidate(self.qualified_id())
 
         # delete this object
         self.object_to_be_deleted.emit(self)
@@ -474,9 +1011,109 @@ class SacredStudy(AbstractDbEntry):
         self._filter = flt
         # note: caller must call load_full!
 
+    def get_filter(self):
+        return self._filter
+
+    # In paged mode, the study does not load its experiments, they are instead fetched page by page
+    # with load_skeleton_page (by the PagedExperimentListModel). Field lists are obtained from a sample
+    # of experiments. Reloads only signal a content change with empty info, and only if the study has changed.
+    def set_paged(self,paged):
+        self._paged = paged
+        self._paged_state = None
+        if paged:
+            # the filesystem is otherwise set up when the study is loaded (its file index is built on first use)
+            self._load_filesystem()
+            # fields discovered earlier remain in use until they have been refreshed
+            self.discover_fields_in_background(refresh=True)
+
+    def is_paged(self):
+        return self._paged
+
+    def load_if_uninitialized(self):
+        if not self._paged:
+            super().load_if_uninitialized()
+
+    def count_experiments(self):
+        return self._mongo_runs_collection.count_documents(self._filter)
+
+    # Load a page of experiment skeletons, sorted by the given mongo paths (and the _id). If after_values
+    # is given (values of the sort paths and _id of the last row of the previous page), keyset pagination is used,
+    # otherwise the first skip documents are skipped.
+    def load_skeleton_page(self,sort_paths,limit,after_values=None,skip=0):
+        sort_spec = [ (p,pymongo.ASCENDING) for p in sort_paths ] + [ ('_id',pymongo.ASCENDING) ]
+        query = self._filter
+        if after_values is not None:
+            all_paths = list(sort_paths) + [ '_id' ]
+            alternatives = []
+            for pos,path in enumerate(all_paths):
+                this_alternative = { p: v for p,v in zip(all_paths[:pos],after_values[:pos]) }
+                this_alternative[path] = { '$gt': after_values[pos] }
+                alternatives.append(this_alternative)
+            keyset_query = { '$or': alternatives }
+            query = { '$and': [ self._filter, keyset_query ] } if len(self._filter) > 0 else keyset_query
+
+        cursor = self._mongo_runs_collection.find(query,projection=SkeletonProjection).sort(sort_spec)
+        return list(cursor.skip(skip).limit(limit))
+
+    # Returns a fetcher (suitable for the background loader) which yields the _ids of all experiments matching the
+    # filter, sorted by the given fields (and the _id). If a field cannot be mapped to a document path (see
+    # mongo_path_for_field), None is yielded instead.
+    def make_sorted_ids_fetcher(self,fields):
+        collection = self._mongo_runs_collection
+        flt = self._filter
+        profile = self._get_profile()
+        has_result_fields = any(f[0] == BrowserState.Fields.FieldType.Result for f in fields)
+
+        def fetcher():
+            result_types = load_result_types(collection,flt) if has_result_fields else set()
+            sort_paths = [ mongo_path_for_field(f,result_types) for f in fields ]
+            if None in sort_paths:
+                yield None
+                return
+            sort_spec = [ (p,pymongo.ASCENDING) for p in sort_paths ] + [ ('_id',pymongo.ASCENDING) ]
+            if Config.CreateSortIndexes:
+                collection.create_index(sort_spec)
+            cursor = profile.apply_batch_size(collection.find(flt,projection={ '_id': 1 }).sort(sort_spec))
+            yield [ x['_id'] for x in cursor ]
+        return fetcher
+
+    # Returns the ways in which the experiments store their results (see load_result_types)
+    def load_result_types(self):
+        return load_result_types(self._mongo_runs_collection,self._filter)
+
+    # Returns True if all (non-null) values at the given path have the same type (in the sense of mongo comparisons).
+    # Otherwise keyset pagination is not possible, since mongo only compares values of the same type.
+    def has_uniform_type(self,path):
+        exists_query = { path: { '$exists': True, '$ne': None } }
+        query = { '$and': [ self._filter, exists_query ] } if len(self._filter) > 0 else exists_query
+        first = list(self._mongo_runs_collection.find(query,projection={ path: 1 }).limit(1))
+        if len(first) == 0:
+            return True
+        val = get_path_value(first[0],path)
+        if type(val) is bool:
+            type_alias = 'bool'
+        elif isinstance(val,numbers.Number):
+            type_alias = 'number'
+        elif isinstance(val,str):
+            type_alias = 'string'
+        elif isinstance(val,datetime.datetime):
+            type_alias = 'date'
+        else:
+            return False
+
+        other_query = { '$and': [ query, { path: { '$not': { '$type': type_alias } } } ] }
+        return len(list(self._mongo_runs_collection.find(other_query,projection={ '_id': 1 }).limit(1))) == 0
+
     def get_database(self):
         return self._database
 
+    # Returns the number of runs and the last heartbeat of the study (see StudyStatistics), or None if they
+    # are not known yet. They are computed in the background (independently of loading the study), and
+    # the database signals a change of the study when they arrive.
+    def get_statistics(self):
+        return StudyStatistics.get_statistics_cache().get(self.qualified_id(),self._mongo_runs_collection,
+                lambda statistics: self._database.notify_study_changed(self))
+
     def list_experiments(self):
         self.load_if_uninitialized()
 #         return sorted(self._experiments.keys()) # but note that the sorting is given by the sort order
@@ -486,6 +1123,10 @@ class SacredStudy(AbstractDbEntry):
         self.load_if_uninitialized()
         return self._experiments.get_by_key(obid)
 
+    # Returns the _id of the experiment at the given position (without loading the study)
+    def get_experiment_id_at(self,pos):
+        return self._experiments.get_key_at(pos)
+
     def get_all_experiments(self):
         self.load_if_uninitialized()
         return [self._experiments.get_by_key(obid)[1] for obid in self._experiments.list_keys()]
@@ -496,28 +1137,90 @@ class SacredStudy(AbstractDbEntry):
         # TODO error handling, TODO move to interior of experiment?
         return next(iter(find_result))
 
+    # Returns the top-level keys of an experiment document, with the (BSON) size and the BSON type name
+    # of each value, as a list of (key, size, type), without transferring the document. Requires MongoDB 4.4
+    # ($bsonSize), otherwise the document is loaded.
+    def load_experiment_key_sizes(self,obid):
+        pipeline = [
+            { '$match': { '_id': obid } },
+            { '$project': { '_id': 0, 'keys': { '$map': { 'input': { '$objectToArray': '$$ROOT' },
+                # $bsonSize only accepts documents, so each value is wrapped
+                'in': { 'k': '$$this.k', 'size': { '$bsonSize': { 'v': '$$this.v' } }, 'type': { '$type': '$$this.v' } } } } } },
+        ]
+        try:
+            result = list(self._mongo_runs_collection.aggregate(pipeline))
+        except pymongo.errors.OperationFailure:
+            exp_dict = self.load_experiment_data(obid)
+            return [ (k,len(bson.BSON.encode({ 'v': v })),'string' if isinstance(v,str) else type(v).__name__) for k,v in exp_dict.items() ]
+        if len(result) == 0:
+            raise KeyError('Experiment %s not found' % str(obid))
+        return [ (x['k'],x['size'],x['type']) for x in result[0]['keys'] ]
+
+    # Returns a single top-level value of an experiment document
+    def load_experiment_value(self,obid,key):
+        projection = { key: 1 } if key == '_id' else { key: 1, '_id': 0 }
+        return self.load_experiment_data(obid,projection=projection).get(key)
+
+    # Access to parts of a (large) top-level string value of an experiment document, such as captured_out,
+    # without transferring the whole string. Positions and lengths are in characters (code points), so that
+    # chunks never split a UTF-8 sequence.
+    def load_experiment_text_length(self,obid,key):
+        return self._aggregate_experiment_value(obid,{ '$strLenCP': { '$ifNull': [ '$' + key, '' ] } },0)
+
+    def load_experiment_text_chunk(self,obid,key,start,count):
+        return self._aggregate_experiment_value(obid,{ '$substrCP': [ { '$ifNull': [ '$' + key, '' ] }, start, count ] },'')
+
+    # Returns (heartbeat, status) of an experiment, which indicate whether the experiment may still change
+    def load_experiment_heartbeat(self,obid):
+        exp_dict = self.load_experiment_data(obid,projection={ '_id': 0, 'heartbeat': 1, 'status': 1 })
+        return (exp_dict.get('heartbeat'),exp_dict.get('status'))
+
+    # Returns the position of the first occurrence of text at or after start, or -1
+    def find_experiment_text(self,obid,key,text,start):
+        return self._aggregate_experiment_value(obid,{ '$indexOfCP': [ { '$ifNull': [ '$' + key, '' ] }, { '$literal': text }, start ] },-1)
+
     def list_fields(self):
         return self.list_config_fields() + self.list_result_fields()
 
+    # In paged mode, the fields are discovered in the background, and the lists are empty until fields_discovered
+    # has been emitted
     def list_config_fields(self):
+        if self._paged:
+            return self._get_paged_fields()[0]
+        if self._use_discovered_fields():
+            return self._discovered_fields[self._get_filter_key(self._filter)][0]
         self.load_if_uninitialized()
-        all_config_fields = set() 
-        for exp in self._experiments.list_values():
-            all_config_fields |= set(exp.get_config_fields())
-        return sorted(all_config_fields)
+        return self._field_index.list_config_fields()
 
     def list_result_fields(self):
+        if self._paged:
+            return self._get_paged_fields()[1]
+        if self._use_discovered_fields():
+            return self._discovered_fields[self._get_filter_key(self._filter)][1]
         self.load_if_uninitialized()
-        all_result_fields = set() 
-        for exp in self._experiments.list_values():
-            all_result_fields |= set(exp.get_result_fields())
-        return sorted(all_result_fields)
+        return self._field_index.list_result_fields()
+
+    # Index of the fields of all loaded experiments (kept up to date by the experiments)
+    def get_field_index(self):
+        return self._field_index
+
+    # Config and result values of all loaded experiments, each experiment owns a row
+    def get_column_store(self):
+        return self._column_store
+
+    # Called by an experiment which has been reloaded
+    def notify_experiment_changed(self,exp):
+        if self._paged:
+            self._notify_paged_change()
+        elif not exp.is_deleted():
+            self._experiments.notify_content_changed([exp.id()])
+            self._emit_field_changes()
 
     def delete_experiments_from_database(self,exp_ids):
         assert type(exp_ids) is set
         query_dict = { '$or': [ { '_id': i } for i in exp_ids ] }
-        res = self._mongo_runs_collection.remove(query_dict)
-        # res - {'ok': 1, 'n': 2}
+        res = self._mongo_runs_collection.delete_many(query_dict)
+        # res.deleted_count - number of deleted experiments
         # TODO interpret, report error if there was one
 # # #         self.load()
         # note: caller MUST reload 
@@ -525,50 +1228,213 @@ class SacredStudy(AbstractDbEntry):
     def get_filesystem(self):
         return self._filesystem
 
+    # Returns a function (suitable for fetchers, see BackgroundLoader) which opens a change stream on the runs
+    # collection, which only reports the type of the change and the affected _id. The function raises a pymongo
+    # error if the server does not support change streams (e.g. standalone servers).
+    def make_change_stream_opener(self,max_await_time_ms=None):
+        collection = self._mongo_runs_collection
+        pipeline = [ { '$project': { 'operationType': 1, 'documentKey': 1 } } ]
+        return lambda: collection.watch(pipeline,max_await_time_ms=max_await_time_ms)
 
+    ############# Internals #############
+    # connection profile, which determines the batch size for large queries
+    def _get_profile(self):
+        return self._database.get_connection().get_profile()
+
+    # Evaluate an aggregation expression on the experiment with the given _id
+    def _aggregate_experiment_value(self,obid,expression,default):
+        pipeline = [ { '$match': { '_id': obid } }, { '$project': { '_id': 0, 'v': expression } } ]
+        result = list(self._mongo_runs_collection.aggregate(pipeline))
+        return result[0]['v'] if len(result) > 0 and result[0].get('v') is not None else default
+
+    # obtain GRIDFS file system
+    def _load_filesystem(self):
+        if self._grid_root is not None:
+            self._filesystem = self._database.get_filesystem(self._grid_root) # will not load filesystem twice
 
-# A single experiment, corresponding to a single run of a sacred script. Relies on parent study in order to load its data.
-class SacredExperiment(AbstractDbEntry):
-    experiment_to_be_changed = QtCore.pyqtSignal()
-    experiment_changed = QtCore.pyqtSignal()
-    object_to_be_deleted = QtCore.pyqtSignal()
+    # Set the list of experiments to new_keys, where skeletons contains parsed skeletons (see parse_skeleton) for all
+    # new experiments and possibly for some existing ones, which are then updated. The skeleton cache is updated
+    # by the caller (usually the fetcher).
+    def _apply_skeleton_delta(self,new_keys,skeletons):
+        known_keys = set(self._experiments.list_keys())
+        new_key_set = set(new_keys)
+
+        self._pending_skeletons = skeletons
+        self._experiments.update(new_keys)
+        self._pending_skeletons = {}
+
+        changed_keys = [ k for k in skeletons.keys() if k in known_keys and k in new_key_set ]
+        for obid in changed_keys:
+            self._experiments.get_by_key(obid)[1].set_parsed_skeleton(*skeletons[obid])
+        if len(changed_keys) > 0:
+            self._experiments.notify_content_changed(changed_keys)
+
+        self._emit_field_changes()
+
+    # Signal fields which appeared or vanished since the last call
+    def _emit_field_changes(self):
+        appeared,vanished = self._field_index.take_changes()
+        if len(appeared) > 0 or len(vanished) > 0:
+            self.fields_changed.emit(self,appeared,vanished)
+
+    # Populate the (uninitialized) study from the skeleton cache, returns False if nothing is cached
+    def _load_from_skeleton_cache(self):
+        cache = SkeletonCache.get_skeleton_cache()
+        if cache is None:
+            return False
+        cached_skeletons = cache.load_study(self.qualified_id())
+        if len(cached_skeletons) == 0:
+            return False
+
+        self._load_timestamp = time.time()
+
+        self._pending_skeletons = cached_skeletons
+        self._experiments.update(sorted(cached_skeletons.keys()))
+        self._pending_skeletons = {}
+
+        self._load_filesystem()
+        return True
+
+    # Returns a function writer(skeletons,removed_keys) which writes parsed skeletons (a dictionary from _id to
+    # skeleton) to the skeleton cache, and removes the given removed experiments. It is meant to be called by
+    # the fetchers, so that the cache is not accessed on the main thread.
+    # The cache holds the unfiltered study, so removals are only recorded if no filter is set.
+    def _make_skeleton_cache_writer(self):
+        cache = SkeletonCache.get_skeleton_cache()
+        study_id = self.qualified_id()
+        enabled = cache is not None and not self._paged
+        record_removals = len(self._filter) == 0
+        def writer(skeletons,removed_keys):
+            if not enabled:
+                return
+            if not record_removals:
+                removed_keys = []
+            if len(skeletons) == 0 and len(removed_keys) == 0:
+                return
+            cache.update_study(study_id,skeletons,removed_keys)
+        return writer
+
+    # Field discovery: the server computes the flattened config and result field names of all experiments
+    # matching the filter. This is used before the experiments have been loaded (and in paged mode).
+    # Results are cached per filter.
+    # Let the server find the fields of the experiments matching the current filter. If refresh is set, fields which
+    # have been discovered before are discovered again (they remain in use until the new ones arrive).
+    def discover_fields_in_background(self,refresh=False):
+        filter_key = self._get_filter_key(self._filter)
+        if filter_key in self._pending_discoveries or (filter_key in self._discovered_fields and not refresh):
+            return
+        self._pending_discoveries.add(filter_key)
+        BackgroundLoader.get_background_loader().submit(self._make_field_discovery_fetcher(),self._receive_discovered_fields,
+                lambda error: self._pending_discoveries.discard(filter_key))
+
+    def has_discovered_fields(self):
+        return self._get_filter_key(self._filter) in self._discovered_fields
+
+    def _make_field_discovery_fetcher(self):
+        collection = self._mongo_runs_collection
+        flt = self._filter
+        filter_key = self._get_filter_key(flt)
+        def fetcher():
+            config_fields = [ x['_id'] for x in collection.aggregate(make_config_fields_pipeline(flt,Config.FieldDiscoveryDepth),allowDiskUse=True) ]
+            result_layouts = [ x['_id'] for x in collection.aggregate(make_result_layouts_pipeline(flt),allowDiskUse=True) ]
+            yield (filter_key,sorted(config_fields),sorted(result_fields_from_layouts(result_layouts)))
+        return fetcher
+
+    def _receive_discovered_fields(self,result):
+        filter_key,config_fields,result_fields = result
+        previous = self._discovered_fields.get(filter_key)
+        self._discovered_fields[filter_key] = (config_fields,result_fields)
+        if filter_key == self._get_filter_key(self._filter):
+            self.fields_discovered.emit(self)
+            if self._paged and previous is not None:
+                # in paged mode, the discovered fields take the place of the field index
+                old_fields = self._make_field_set(*previous)
+                new_fields = self._make_field_set(config_fields,result_fields)
+                if old_fields != new_fields:
+                    self.fields_changed.emit(self,sorted(new_fields - old_fields),sorted(old_fields - new_fields))
+
+    @staticmethod
+    def _make_field_set(config_fields,result_fields):
+        return set((BrowserState.Fields.FieldType.Config,x) for x in config_fields) | set((BrowserState.Fields.FieldType.Result,x) for x in result_fields)
+
+    # fields in paged mode, which are discovered in the background if they are not known yet
+    def _get_paged_fields(self):
+        filter_key = self._get_filter_key(self._filter)
+        if filter_key not in self._discovered_fields:
+            self.discover_fields_in_background()
+            return ([],[])
+        return self._discovered_fields[filter_key]
+
+    # discovered fields are used while the experiments have not been (completely) loaded
+    def _use_discovered_fields(self):
+        return (self.is_loading() or not self.is_initialized()) and self.has_discovered_fields()
+
+    @staticmethod
+    def _get_filter_key(flt):
+        return repr(flt)
+
+    # in paged mode, check (cheaply) whether the study has changed
+    def _check_paged_state(self):
+        for new_state in self._make_paged_state_fetcher()():
+            self._apply_paged_state(new_state)
+
+    # Returns a fetcher (suitable for the background loader) which yields the state of the study in paged
+    # mode, as (number of experiments, newest heartbeat)
+    def _make_paged_state_fetcher(self):
+        collection = self._mongo_runs_collection
+        flt = self._filter
+        def fetcher():
+            newest = list(collection.find(flt,projection={'heartbeat': 1}).sort('heartbeat',pymongo.DESCENDING).limit(1))
+            yield (collection.count_documents(flt),newest[0].get('heartbeat') if len(newest) > 0 else None)
+        return fetcher
+
+    def _apply_paged_state(self,new_state):
+        if self._paged_state is not None and new_state != self._paged_state:
+            self._notify_paged_change()
+            self.discover_fields_in_background(refresh=True)
+        self._paged_state = new_state
+
+    def _notify_paged_change(self):
+        chg = ChangeData(ChangeType.Content,([],[]))
+        self.experiments_to_be_changed.emit(self,chg)
+        self.experiments_changed.emit(self,chg)
+
+
+
+
+# A single experiment. Since studies may contain very many experiments, this is not a QObject (and not an
+# AbstractDbEntry), but a lightweight record which provides the same interface for loading. Changes are signalled
+# by the study (experiments_changed), the experiment itself has no signals.
+#
+# The config and result values are kept in a column store (usually the one of the study, in which case the
+# field index of the study is updated as well).
+class SacredExperiment:
+    __slots__ = ('_study','_column_store','_obid','_row','_status','_details','_experiment_data','_heartbeat_timestamp','_load_timestamp')
 
     ############# General Interface #############
 
-    def __init__(self,study,obid,parent):
-        super().__init__(parent)
+    # If skeleton_data is given, it must be the result of a query with SkeletonProjection, and
+    # is used instead of querying the database. Likewise for cached_skeleton, which must be the result
+    # of parse_skeleton (as stored in the skeleton cache). If column_store is None, the column store of the study is used.
+    def __init__(self,study,obid,skeleton_data=None,cached_skeleton=None,column_store=None):
         self._study = study
+        self._column_store = column_store if column_store is not None else study.get_column_store()
         self._obid = obid
 
-#         # load initial data
-#         exp_dict = self._study.load_experiment_data(self._obid,projection={'_id': 1, 'config': 1, 'result': 1, 'status': 1})
-#         if 'result' in exp_dict:
-#             result_dict = parse_result(exp_dict['result'])
-#         else:
-#             result_dict = {}
-# 
-#         if 'config' in exp_dict:
-#             config_dict = parse_config(exp_dict['config'])
-#         else:
-#             config_dict = {}
-# 
-#         status = exp_dict['status'] if 'status' in exp_dict else 'UNKNOWN'
-# 
-#         self._config = config_dict
-#         self._result = result_dict
-#         self._status = status 
-#         self._details = None # loaded only when necessary, may really be large
-#         self._experiment_data = None # only loaded if necessary
-
         # invalid, call load_skeleton
-        self._config = None
-        self._result = None
+        self._row = self._column_store.allocate_row()
         self._status = None
         self._details = None 
         self._experiment_data = None 
         self._heartbeat_timestamp = None
+        self._load_timestamp = None
 
-        self.load_skeleton()
+        if skeleton_data is not None:
+            self.set_skeleton_data(skeleton_data)
+        elif cached_skeleton is not None:
+            self.set_parsed_skeleton(*cached_skeleton)
+        else:
+            self.load_skeleton()
 
     def name(self):
         return 'Experiment_' + str(self._obid)
@@ -576,55 +1442,57 @@ class SacredExperiment(AbstractDbEntry):
     def id(self):
         return self._obid
 
-    def load_skeleton(self):
-# #         print('Loading experiment skeleton for obid',self._obid)
-        exp_dict = self._study.load_experiment_data(self._obid,projection={'_id': 1, 'config': 1, 'result': 1, 'status': 1, 'heartbeat': 1})
-        if 'result' in exp_dict:
-            result_dict = parse_result(exp_dict['result'])
-        else:
-            result_dict = {}
+    def qualified_id(self):
+        return self._study.qualified_id() + '-' + str(self._obid)
 
-        if 'config' in exp_dict:
-            config_dict = parse_config(exp_dict['config'])
-        else:
-            config_dict = {}
+    def typename(self):
+        return type(self).__name__
 
-        status = exp_dict['status'] if 'status' in exp_dict else 'UNKNOWN'
+    def load_skeleton(self):
+        exp_dict = self._study.load_experiment_data(self._obid,projection=SkeletonProjection)
+        self.set_skeleton_data(exp_dict)
 
-        self._config = config_dict
-        self._result = result_dict
+    # Update the skeleton from a document which was loaded with SkeletonProjection (usually by the 
+    # parent study, which loads the skeletons of all experiments at once).
+    def set_skeleton_data(self,exp_dict):
+        self.set_parsed_skeleton(*parse_skeleton(exp_dict))
+
+    # Set the skeleton from already parsed data (heartbeat may be None if unknown)
+    def set_parsed_skeleton(self,config_dict,result_dict,status,current_heartbeat):
+        self._set_field_dicts(config_dict,result_dict)
         self._status = status 
 
-        # finally check whether the heartbeat is new, ugly conditional partly for debugging
-        if 'heartbeat' in exp_dict:
-            current_heartbeat = exp_dict['heartbeat'] # should be datetime
-            if current_heartbeat is not None:
-                if self._heartbeat_timestamp is None:
-                    pass
-#                     print('IIIIIIIIIIIIINITIALIZING heartbeat')
-                elif self._heartbeat_timestamp < current_heartbeat:
-#                     print('NNNNNNNEEEEEEEEEEEWWWWWWWWWWWW obid',self._obid)
-                    self._load_timestamp = None # mark as NOT current, next call to load_if_uninitialized will reload
-                else:
-                    pass
-#                     print('-----------NOCHANGE')
+        # finally check whether the heartbeat is new
+        if current_heartbeat is not None:
+            if self._heartbeat_timestamp is not None and self._heartbeat_timestamp < current_heartbeat:
+                self._load_timestamp = None # mark as NOT current, next call to load_if_uninitialized will reload
             self._heartbeat_timestamp = current_heartbeat
 
     def load_full(self):
         print('Loading full experiment for obid',self._obid)
-        self.experiment_to_be_changed.emit()
-
         self._details = self._study.load_experiment_data(self._obid)
-        self._config = parse_config(self._details['config']) if 'config' in self._details else {}
-        self._result = parse_result(self._details['result']) if 'result' in self._details else {}
+        self._set_field_dicts(parse_config(self._details['config']) if 'config' in self._details else {},
+                parse_result(self._details['result']) if 'result' in self._details else {})
 
         self._load_timestamp = time.time()
-        self.experiment_changed.emit()
+        self._study.notify_experiment_changed(self)
+
+    def is_initialized(self):
+        return self._load_timestamp is not None
+
+    def load_if_uninitialized(self):
+        if not self.is_initialized():
+            self.load_full()
 
+    # Must be called when the experiment is no longer used (by the owner of the column store)
     def delete(self):
-        self.object_to_be_deleted.emit()
-        super().delete()
+        if self._uses_study_store():
+            self._study.get_field_index().remove(self._column_store.get_row_shape(self._row))
+        self._column_store.free_row(self._row)
+        self._row = None
 
+    def is_deleted(self):
+        return self._row is None
 
     ############# Specific Interface #############
 
@@ -632,30 +1500,71 @@ class SacredExperiment(AbstractDbEntry):
         self.load_if_uninitialized()
         return self._experiment_data
 
+    # Returns the flattened (config, result) dictionaries
+    def get_field_dicts(self):
+        config_dict = {}
+        result_dict = {}
+        for (tp,name),value in self._column_store.get_row(self._row).items():
+            if tp == BrowserState.Fields.FieldType.Config:
+                config_dict[name] = value
+            else:
+                result_dict[name] = value
+        return (config_dict,result_dict)
+
     def get_config_fields(self):
-        return sorted(self._config.keys())
+        return sorted(name for tp,name in self._column_store.get_row_fields(self._row) if tp == BrowserState.Fields.FieldType.Config)
 
     def get_result_fields(self):
-        return sorted(self._result.keys())
+        return sorted(name for tp,name in self._column_store.get_row_fields(self._row) if tp == BrowserState.Fields.FieldType.Result)
+
+    def has_field(self,fieldname):
+        return self._column_store.has_value(self._row,fieldname)
 
     def get_field(self,fieldname):
-        if fieldname[0] == BrowserState.Fields.FieldType.Config:
-            return self._config[fieldname[1]] if fieldname[1] in self._config else '---'
-        elif fieldname[0] == BrowserState.Fields.FieldType.Result:
-            return self._result[fieldname[1]] if fieldname[1] in self._result else '---'
-        else:
+        if fieldname[0] not in (BrowserState.Fields.FieldType.Config,BrowserState.Fields.FieldType.Result):
             raise KeyError('Field %s not found' % fieldname)
+        return self._column_store.get_value(self._row,fieldname,'---')
+
+    # Row of this experiment in its column store
+    def get_row(self):
+        return self._row
 
     def get_status(self):
         return self._status
 
+    # Heartbeat from the last skeleton update (None if unknown)
+    def get_heartbeat(self):
+        return self._heartbeat_timestamp
+
     def get_details(self):
         self.load_if_uninitialized()
         return self._details
 
+    # Lazy alternative to get_details: returns the top-level keys of the document with the sizes and types of
+    # their values, as a list of (key, size, type)
+    def load_detail_sizes(self):
+        return self._study.load_experiment_key_sizes(self._obid)
+
+    # Returns a single top-level value of the document (from the full document, if it has been loaded)
+    def load_detail_value(self,key):
+        if self._details is not None and self.is_initialized():
+            return self._details.get(key)
+        return self._study.load_experiment_value(self._obid,key)
+
     def get_study(self):
         return self._study
 
+    ############# Internals #############
+    def _uses_study_store(self):
+        return self._column_store is self._study.get_column_store()
+
+    def _set_field_dicts(self,config_dict,result_dict):
+        shape = get_field_shape(self._column_store,tuple(config_dict.keys()),tuple(result_dict.keys()))
+        values = tuple(config_dict.values()) + tuple(result_dict.values())
+        if self._uses_study_store():
+            self._study.get_field_index().replace(self._column_store.get_row_shape(self._row),shape,values)
+        self._column_store.set_row_values(self._row,shape,values)
+
 class SacredFileSystem(AbstractDbEntry):
     # These are called from load()
     # TODO do we need that?
@@ -663,6 +1572,9 @@ class SacredFileSystem(AbstractDbEntry):
     fs_changed = QtCore.pyqtSignal()
     object_to_be_deleted = QtCore.pyqtSignal()
 
+    # Projection for the metadata index, which only uses the files collection (never the chunks)
+    FileIndexProjection = { '_id': 1, 'filename': 1, 'length': 1, 'md5': 1, 'uploadDate': 1 }
+
     ############# General Interface #############
 
     def __init__(self,parent,root_collection):
@@ -670,7 +1582,13 @@ class SacredFileSystem(AbstractDbEntry):
         self._parent = parent
         self._root_collection = root_collection
         self._grid_fs = gridfs.GridFS(self._parent.get_mongo_database(),root_collection)
-        print('CREATED NEW FILESYSTEM',root_collection,' and list of files is',self.list())
+        self._files_collection = self._parent.get_mongo_database()[root_collection + '.files']
+
+        # Metadata of all files (see FileIndexProjection), indexed by filename (newest version only). Built on
+        # first use, and afterwards updated with the files uploaded after the newest known upload date.
+        self._file_index = None
+        self._file_index_watermark = None
+        print('CREATED NEW FILESYSTEM',root_collection)
 
     def name(self):
         return self._root_collection
@@ -692,12 +1610,137 @@ class SacredFileSystem(AbstractDbEntry):
 
     # Get all SOURCE files belonging to some experiment
     # all TODO
+    # Contents are cached (see FileCache).
     def get_file(self,name):
-        data = self._grid_fs.find_one({'filename': name}).read()
+        cache_key = self._get_cache_key(self._get_file_info_or_raise(name))
+        data = FileCache.get_file_cache().get(cache_key)
+        if data is None:
+            data = b''.join(self.read_file_chunks(name))
+            FileCache.get_file_cache().put(cache_key,data)
         return data
 
+    # Returns the statistics of the file cache (see FileCache.get_statistics)
+    def get_cache_statistics(self):
+        return FileCache.get_file_cache().get_statistics()
+
+    # Returns the GridOut object for the (newest version of the) file with the given name, which reads
+    # the content on demand
+    def open_file(self,name):
+        return self._grid_fs.get(self._get_file_info_or_raise(name)['_id'])
+
+    # Returns the metadata (see FileIndexProjection) of the file with the given name, or None
+    def get_file_info(self,name):
+        self._update_file_index()
+        return self._file_index.get(name)
+
+    # Update the metadata index with new files. If full is set, the index is rebuilt (e.g. to remove deleted files).
+    def refresh_file_index(self,full=False):
+        if full:
+            self._file_index = None
+        self._update_file_index(incremental=True)
+
+    # Generator which yields the content of the file chunk by chunk. If progress is given, it is called
+    # with (bytes read, total bytes) after each chunk.
+    def read_file_chunks(self,name,progress=None):
+        grid_out = self.open_file(name)
+        bytes_read = 0
+        while True:
+            chunk = grid_out.readchunk()
+            if len(chunk) == 0:
+                break
+            bytes_read += len(chunk)
+            if progress is not None:
+                progress(bytes_read,grid_out.length)
+            yield chunk
+
+    # Returns at most max_bytes from the beginning of the file, and whether the file is longer. Small files
+    # are read completely, so that they are cached.
+    def read_file_head(self,name,max_bytes):
+        if self._get_file_info_or_raise(name).get('length',0) <= Config.FileCacheMaxFileSize:
+            data = self.get_file(name)
+            return (data[:max_bytes],len(data) > max_bytes)
+        grid_out = self.open_file(name)
+        return (grid_out.read(max_bytes),grid_out.length > max_bytes)
+
+    # Save the file to disk (binary, chunk by chunk). If progress is given, it is called with (bytes written,
+    # total bytes) after each chunk, and saving is aborted (and the partial file removed) if it returns False. 
+    # Returns True if the file has been saved.
+    def save_file(self,name,target_filename,progress=None):
+        cached_data = FileCache.get_file_cache().get(self._get_cache_key(self._get_file_info_or_raise(name)))
+        if cached_data is not None:
+            with open(target_filename,'wb') as fp:
+                fp.write(cached_data)
+            if progress is not None:
+                progress(len(cached_data),len(cached_data))
+            return True
+
+        with open(target_filename,'wb') as fp:
+            grid_out = self.open_file(name)
+            bytes_written = 0
+            while True:
+                chunk = grid_out.readchunk()
+                if len(chunk) == 0:
+                    return True
+                fp.write(chunk)
+                bytes_written += len(chunk)
+                if progress is not None and progress(bytes_written,grid_out.length) is False:
+                    break
+        os.remove(target_filename)
+        return False
+
     def list(self):
-        return self._grid_fs.list()
+        self._update_file_index()
+        return sorted(self._file_index.keys())
+
+    ############# Internals #############
+    # Build the metadata index if necessary. If incremental is set, files which have been uploaded after the
+    # newest known file are added.
+    def _update_file_index(self,incremental=False):
+        query = self._make_file_index_query(incremental)
+        if query is None:
+            return
+
+        # in ascending order of upload date, so that newer versions of a file replace older ones
+        self._apply_file_infos(self._files_collection.find(query,projection=self.FileIndexProjection).sort('uploadDate',pymongo.ASCENDING))
+
+    # Returns the query for the files which must be added to the index, or None if the index is up to date
+    def _make_file_index_query(self,incremental):
+        if self._file_index is None:
+            self._file_index = {}
+            self._file_index_watermark = None
+            return {}
+        elif incremental and self._file_index_watermark is not None:
+            return { 'uploadDate': { '$gt': self._file_index_watermark } }
+        elif incremental:
+            return {}
+        else:
+            return None
+
+    # Add file metadata (in ascending order of upload date) to the index
+    def _apply_file_infos(self,file_infos):
+        for file_info in file_infos:
+            if 'filename' not in file_info:
+                continue
+            self._file_index[file_info['filename']] = file_info
+            if file_info.get('uploadDate') is not None:
+                self._file_index_watermark = file_info['uploadDate']
+
+    # Files with the same md5 have the same content, otherwise the content is identified by the file id
+    def _get_cache_key(self,file_info):
+        if file_info.get('md5') is not None:
+            return ('md5',file_info['md5'])
+        else:
+            return ('id',self.qualified_id(),file_info['_id'])
+
+    def _get_file_info_or_raise(self,name):
+        file_info = self.get_file_info(name)
+        if file_info is None:
+            # the file may have been uploaded after the index was built
+            self.refresh_file_index()
+            file_info = self._file_index.get(name)
+        if file_info is None:
+            raise KeyError('File %s not found' % name)
+        return file_info
 
     # delete filesystem from database, assumes that parent SacredDatabase object also deletes link to this object
     def delete_filesystem(self):
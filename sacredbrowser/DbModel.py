@@ -7,9 +7,15 @@
 from . import DbEntries
 from . import BrowserState
 from . import Utilities
+from . import ColumnStore
+from . import Config
 
 from PyQt5 import QtCore, QtGui, QtWidgets
 
+import collections
+import datetime
+import weakref
+
 SacredItemRole = QtCore.Qt.UserRole + 1
 
 # experiment colors
@@ -26,6 +32,13 @@ class StudyTreeModel(QtCore.QAbstractItemModel):
         self._connection = connection 
         # a sacred connection, i.e. the root of database access. Currently not replaceable?
 
+        # databases whose signals are connected to this model (each database must be connected only once)
+        self._connected_databases = weakref.WeakSet()
+        # databases whose studies are being reset (see slot_studies_to_be_changed), mapped to whether their rows
+        # are being removed, and databases which must appear empty while their rows are replaced
+        self._resetting_databases = {}
+        self._emptied_databases = set()
+
         # make connections at all levels. Don't forget to reconnect the studies whenever anything changes
         self._connection.databases_to_be_changed.connect(self._slot_databases_to_be_changed)
         self._connection.databases_changed.connect(self._slot_databases_changed)
@@ -33,14 +46,12 @@ class StudyTreeModel(QtCore.QAbstractItemModel):
     def index(self,row,column,parent):
         if not parent.isValid():
             # this is an index for a database
-            dbname = self._connection.list_databases()[row]
-            dbitem = self._connection.get_database(dbname)
+            dbitem = self._connection.get_database_at(row)
             return self.createIndex(row,column,dbitem)
         else:
             # this refers to a study; take the parent database from the parent index
             database = parent.internalPointer()
-            studyname = database.list_studies()[row]
-            studyitem = database.get_study(studyname)
+            studyitem = database.get_study_at(row)
             return self.createIndex(row,column,studyitem)
 
     def parent(self,index):
@@ -53,7 +64,7 @@ class StudyTreeModel(QtCore.QAbstractItemModel):
             parent_database = item.get_database()
             parent_name = parent_database.id()
             connection = parent_database.get_connection()
-            parent_row = connection.list_databases().index(parent_name)
+            parent_row = connection.get_database_row(parent_name)
             return self.createIndex(parent_row,0,parent_database)
 
     def rowCount(self,parent):
@@ -69,11 +80,13 @@ class StudyTreeModel(QtCore.QAbstractItemModel):
             if item.typename() == 'SacredConnection':
 #                 print('Returning %d rows for connection' % len(item.list_databases()))
 #                 print('For item %s of type connection, rowCount is %d' % (item.name(),len(item.list_databases())))
-                return len(item.list_databases())
+                return item.count_databases()
             elif item.typename() == 'SacredDatabase':
 #                 print('Returning %d rows for database %s' % (len(item.list_studies()),item.id()))
 #                 print('For item %s of type database, rowCount is %d' % (item.name(),len(item.list_studies())))
-                return len(item.list_studies())
+                if item in self._emptied_databases:
+                    return 0
+                return item.count_studies()
             elif item.typename() == 'SacredStudy':
 #                 print('Returning 0 rows for study',item.name())
                 return 0
@@ -88,6 +101,8 @@ class StudyTreeModel(QtCore.QAbstractItemModel):
             return None
         item = index.internalPointer()
         if role == QtCore.Qt.DisplayRole or role == QtCore.Qt.ToolTipRole:
+            if item.typename() == 'SacredStudy' and Config.ShowStudyStatistics:
+                return self._format_study(item)
             return item.id()
         elif role == SacredItemRole:
             return item
@@ -103,20 +118,33 @@ class StudyTreeModel(QtCore.QAbstractItemModel):
     def sacred_from_index(self,index):
         return index.internalPointer()
 
+    # Study name with run count and last heartbeat, as far as they are known
+    def _format_study(self,study):
+        statistics = study.get_statistics()
+        if statistics is None:
+            return study.id()
+        text = '%s (%d runs' % (study.id(),statistics.run_count)
+        if isinstance(statistics.last_heartbeat,datetime.datetime):
+            text += ', last active %s' % statistics.last_heartbeat.strftime('%Y-%m-%d %H:%M')
+        return text + ')'
+
     def index_from_sacred(self,sacred_item):
         if sacred_item.typename() == 'SacredDatabase':
             parent_connection = sacred_item.get_connection()
-            row = parent_connection.list_databases().index(sacred_item.id())
+            row = parent_connection.get_database_row(sacred_item.id())
             return self.createIndex(row,0,sacred_item)
         elif sacred_item.typename() == 'SacredStudy':
             parent_database = sacred_item.get_database()
-            row = parent_database.list_studies().index(sacred_item.id())
+            row = parent_database.get_study_row(sacred_item.id())
             return self.createIndex(row,0,sacred_item)
         else:
             raise Exception('Wrong type')
 
     def _connect_database_slots(self,db): 
         # connection will be deleted automatically when the database is deleted
+        if db in self._connected_databases:
+            return
+        self._connected_databases.add(db)
         db.studies_to_be_changed.connect(self.slot_studies_to_be_changed)
         db.studies_changed.connect(self.slot_studies_changed)
 
@@ -149,10 +177,9 @@ class StudyTreeModel(QtCore.QAbstractItemModel):
                 self.dataChanged.emit(idx,idx)
         elif change_data[0] == DbEntries.ChangeType.Insert:
             self.endInsertRows()
-            # connect slot for this database
-            n = self._connection.list_databases()[change_data[1][0]]
-            db = self._connection.get_database(n)
-            self._connect_database_slots(db)
+            # connect slots for the inserted databases
+            for row in range(change_data.info[0],change_data.info[0] + change_data.info[1]):
+                self._connect_database_slots(self._connection.get_database_at(row))
         elif change_data[0] == DbEntries.ChangeType.Remove:
             self.endRemoveRows()
 
@@ -166,7 +193,12 @@ class StudyTreeModel(QtCore.QAbstractItemModel):
             return
 
         if change_data[0] == DbEntries.ChangeType.Reset:
-            self.beginResetModel()
+            # A model reset would collapse all databases in the view, so only the rows of this database are
+            # replaced: they are removed now, and the new ones are inserted in slot_studies_changed
+            row_count = self.rowCount(parent)
+            self._resetting_databases[database] = row_count > 0
+            if row_count > 0:
+                self.beginRemoveRows(parent,0,row_count - 1)
         elif change_data[0] == DbEntries.ChangeType.Content:
             pass
         elif change_data[0] == DbEntries.ChangeType.Insert:
@@ -188,7 +220,17 @@ class StudyTreeModel(QtCore.QAbstractItemModel):
             return
 
         if change_data[0] == DbEntries.ChangeType.Reset:
-            self.endResetModel()
+            # the database appears empty until the new rows are inserted
+            self._emptied_databases.add(database)
+            if self._resetting_databases.pop(database,False):
+                self.endRemoveRows()
+            row_count = database.count_studies() if database.is_initialized() else 0
+            if row_count > 0:
+                self.beginInsertRows(parent,0,row_count - 1)
+            self._emptied_databases.discard(database)
+            if row_count > 0:
+                self.endInsertRows()
+            self.dataChanged.emit(parent,parent)
         elif change_data[0] == DbEntries.ChangeType.Content:
             for row in change_data.info[0]:
                 idx = self.index(row,0,parent)
@@ -238,8 +280,8 @@ class ExperimentListModel(QtCore.QAbstractTableModel):
         # note that in the respective slot functions, further connections are made
 
     def rowCount(self,idx):
-        study = self._browser_state.current_study.get_study()
-        return len(study.list_experiments()) if study is not None else 0
+        # must match the sorted list, which is updated after the study (e.g. during background loading)
+        return self._sorted_experiment_list.get_experiment_count()
 
     def columnCount(self,idx):
         return self._browser_state.fields.visible_fields_count()
@@ -341,3 +383,162 @@ class ExperimentListModel(QtCore.QAbstractTableModel):
         self.dataChanged.emit(from_idx,to_idx)
 
 
+# Alternative to ExperimentListModel for very large studies (see Config.UsePagedExperimentList). The experiments
+# of the study are not held in memory: rows are fetched from the server in pages of PageSize rows when they are
+# displayed, sorted on the server according to the current sort order. The next page is fetched with keyset
+# pagination (continuing after the sort values of the last row of the previous page) whenever that is possible, 
+# otherwise by skipping rows. At most MaxCachedPages pages are kept, the least recently used page is evicted first.
+class PagedExperimentListModel(QtCore.QAbstractTableModel):
+    PageSize = 200
+    MaxCachedPages = 20
+
+    def __init__(self,browser_state):
+        super().__init__()
+        self._browser_state = browser_state # singleton object
+
+        self._study = None
+        self._row_count = 0
+        self._sort_paths = []
+        self._keyset_possible = False
+
+        self._pages = collections.OrderedDict() # page number -> list of experiments, in LRU order
+        self._page_ends = {} # page number -> sort values of the last row, for keyset pagination
+
+        self._browser_state.current_study.study_to_be_changed.connect(self._slot_study_to_be_changed)
+        self._browser_state.current_study.study_changed.connect(self._slot_study_changed)
+        self._browser_state.sort_order.sort_order_changed.connect(self._slot_sort_order_changed)
+        self._browser_state.fields.visible_fields_to_be_changed.connect(self.slot_visible_fields_to_be_changed)
+        self._browser_state.fields.visible_fields_changed.connect(self.slot_visible_fields_changed)
+        self._browser_state.general_settings.view_mode_changed.connect(self.slot_view_mode_changed)
+
+    def rowCount(self,idx):
+        return self._row_count if not idx.isValid() else 0
+
+    def columnCount(self,idx):
+        return self._browser_state.fields.visible_fields_count()
+
+    def data(self,index,role):
+        if role not in [ QtCore.Qt.DisplayRole, QtCore.Qt.ToolTipRole, QtCore.Qt.BackgroundColorRole, SacredItemRole ]:
+            return None
+
+        exp = self.get_experiment_at(index.row())
+        if exp is None:
+            return None
+
+        if role == QtCore.Qt.DisplayRole or role == QtCore.Qt.ToolTipRole:
+            fieldname = self._browser_state.fields.get_visible_fields()[index.column()]
+            value = exp.get_field(fieldname)
+            if fieldname[0] == BrowserState.Fields.FieldType.Result:
+                return process_result(value,self._browser_state.general_settings.get_view_mode())
+            else:
+                return value
+        elif role == QtCore.Qt.BackgroundColorRole:
+            status = exp.get_status()
+            if status == 'FAILED':
+                return QtGui.QBrush(FailedColor)
+            elif status == 'INTERRUPTED':
+                return QtGui.QBrush(InterruptedColor)
+            elif status == 'RUNNING':
+                return QtGui.QBrush(RunningColor)
+            else:
+                return None
+        elif role == SacredItemRole:
+            return exp
+
+    def headerData(self,index,orientation,role):
+        if role == QtCore.Qt.DisplayRole:
+            if orientation == QtCore.Qt.Vertical:
+                return '%d' % index
+            else:
+                return self._browser_state.fields.get_visible_fields()[index][1]
+        else:
+            return super().headerData(index,orientation,role)
+
+    # Returns the experiment at the given row, or None if it cannot be loaded (e.g. rows have been deleted meanwhile)
+    def get_experiment_at(self,row):
+        page_no,offset = divmod(row,self.PageSize)
+        page = self._get_page(page_no)
+        return page[offset] if offset < len(page) else None
+
+    # Forget all cached rows and recount (e.g. after the filter has changed)
+    def reload(self):
+        self.beginResetModel()
+        self._clear_pages()
+        self._row_count = self._study.count_experiments() if self._study is not None else 0
+        self.endResetModel()
+
+    ############# Paging #############
+    def _get_page(self,page_no):
+        if page_no in self._pages:
+            self._pages.move_to_end(page_no)
+            return self._pages[page_no]
+
+        if page_no > 0 and self._keyset_possible and (page_no - 1) in self._page_ends:
+            exp_dicts = self._study.load_skeleton_page(self._sort_paths,self.PageSize,after_values=self._page_ends[page_no - 1])
+        else:
+            exp_dicts = self._study.load_skeleton_page(self._sort_paths,self.PageSize,skip=page_no * self.PageSize)
+
+        # each page has its own column store, which is freed with the page (and the experiments which are still in use)
+        page_store = ColumnStore.ColumnStore()
+        page = [ DbEntries.SacredExperiment(self._study,x['_id'],skeleton_data=x,column_store=page_store) for x in exp_dicts ]
+        if len(exp_dicts) > 0:
+            end_values = tuple(DbEntries.get_path_value(exp_dicts[-1],p) for p in self._sort_paths) + (exp_dicts[-1]['_id'],)
+            # null values cannot be compared by the server
+            if None not in end_values:
+                self._page_ends[page_no] = end_values
+
+        self._pages[page_no] = page
+        while len(self._pages) > self.MaxCachedPages:
+            self._pages.popitem(last=False)
+
+        return page
+
+    def _clear_pages(self):
+        self._pages.clear()
+        self._page_ends.clear()
+
+    def _update_sort_paths(self):
+        order = self._browser_state.sort_order.get_order()
+        result_types = self._study.load_result_types() if self._study is not None else set()
+        paths = [ DbEntries.mongo_path_for_field(f,result_types) for f in order ]
+        self._sort_paths = [ p for p in paths if p is not None ]
+        if self._study is not None:
+            self._keyset_possible = all(self._study.has_uniform_type(p) for p in self._sort_paths)
+        else:
+            self._keyset_possible = False
+
+    ############# Slots #############
+    def _slot_study_to_be_changed(self,study):
+        if self._study is not None:
+            self._study.experiments_changed.disconnect(self._slot_experiments_changed)
+
+    def _slot_study_changed(self,study):
+        self._study = study if study is not None and study.is_paged() else None
+        if self._study is not None:
+            self._study.experiments_changed.connect(self._slot_experiments_changed)
+        self._update_sort_paths()
+        self.reload()
+
+    def _slot_sort_order_changed(self,order,was_reset):
+        self._update_sort_paths()
+        self.reload()
+
+    def _slot_experiments_changed(self,study,change_data):
+        # the study only tells that something has changed
+        new_row_count = self._study.count_experiments()
+        if new_row_count != self._row_count:
+            self.reload()
+        else:
+            self._clear_pages()
+            if self._row_count > 0:
+                self.dataChanged.emit(self.index(0,0),self.index(self._row_count - 1,self.columnCount(QtCore.QModelIndex()) - 1))
+
+    def slot_visible_fields_to_be_changed(self,change_data):
+        self.beginResetModel()
+
+    def slot_visible_fields_changed(self,visible,change_data):
+        self.endResetModel()
+
+    def slot_view_mode_changed(self,new_mode):
+        if self._row_count > 0:
+            self.dataChanged.emit(self.index(0,0),self.index(self._row_count - 1,self.columnCount(QtCore.QModelIndex()) - 1))
@@ -1,4 +1,6 @@
 from . import BrowserState
+from . import LargeTextViewer
+from . import Config
 
 from PyQt5 import QtCore, QtGui, QtWidgets
 
@@ -6,9 +8,22 @@ import re
 import os
 
 FilenameRole = QtCore.Qt.UserRole + 1
-
-
-# This is the dialog which displays details about a single experiment instance.
+KeyRole = QtCore.Qt.UserRole + 2
+SizeRole = QtCore.Qt.UserRole + 3
+TypeRole = QtCore.Qt.UserRole + 4
+
+# Format a size in bytes for display
+def format_size(size):
+    for unit in [ 'B', 'kB', 'MB' ]:
+        if size < 1024:
+            return '%d %s' % (size,unit) if unit == 'B' else '%.1f %s' % (size,unit)
+        size /= 1024
+    return '%.1f GB' % size
+
+
+# This is the dialog which displays details about a single experiment instance. The database entry is 
+# loaded lazily: first only the top-level keys (with the sizes of their values) are loaded, each value is
+# only loaded when it is selected. 
 class DetailsDialog(QtWidgets.QDialog):
 
     def __init__(self,app,experiment,filesystem):
@@ -17,6 +32,9 @@ class DetailsDialog(QtWidgets.QDialog):
         self._experiment = experiment
         self._filesystem = filesystem
 
+        # values of the database entry which have been loaded so far
+        self._entry_values = {}
+
         self._make_layout()
 
         self._make_config_model()
@@ -29,6 +47,7 @@ class DetailsDialog(QtWidgets.QDialog):
         self._save_file_button.clicked.connect(self._slot_save_button_clicked)
 
         self._update_preview_buttons()
+        self._update_files_label()
 
     def _make_layout(self):
         # widgets 
@@ -43,6 +62,11 @@ class DetailsDialog(QtWidgets.QDialog):
         self._entry_list.setSelectionMode(QtWidgets.QAbstractItemView.SingleSelection)
         self._entry_display = QtWidgets.QTextEdit()
         self._entry_display.setReadOnly(True)
+        # large text entries are shown in a separate viewer, which only loads parts of the text
+        self._large_text_viewer = LargeTextViewer.LargeTextViewer()
+        self._entry_stack = QtWidgets.QStackedWidget()
+        self._entry_stack.addWidget(self._entry_display)
+        self._entry_stack.addWidget(self._large_text_viewer)
 
         self._files_label = QtWidgets.QLabel('Attached Files')
         self._files_list = QtWidgets.QListView()
@@ -60,7 +84,7 @@ class DetailsDialog(QtWidgets.QDialog):
 
         self._main_layout.addWidget(self._entry_label,2,0,1,2)
         self._main_layout.addWidget(self._entry_list,3,0)
-        self._main_layout.addWidget(self._entry_display,3,1)
+        self._main_layout.addWidget(self._entry_stack,3,1)
 
         self._main_layout.addWidget(self._files_label,4,0,1,2)
         self._main_layout.addWidget(self._files_list,5,0,1,2)
@@ -91,8 +115,11 @@ class DetailsDialog(QtWidgets.QDialog):
         self._entry_list.setModel(self._entry_model)
 
         # iterate over entry keys, fill model
-        for key in sorted(self._experiment.get_details().keys()):
-            item = QtGui.QStandardItem(key)
+        for key,size,tp in sorted(self._experiment.load_detail_sizes()):
+            item = QtGui.QStandardItem('%s (%s)' % (key,format_size(size)))
+            item.setData(key,KeyRole)
+            item.setData(size,SizeRole)
+            item.setData(tp,TypeRole)
             item.setEditable(False)
             self._entry_model.appendRow(item)
 
@@ -108,7 +135,7 @@ class DetailsDialog(QtWidgets.QDialog):
         # iterate over entry keys, fill model
         if self._filesystem is not None:
             # sources
-            exp_dict = self._experiment.get_details()['experiment']
+            exp_dict = self._get_entry_value('experiment') or {}
             base_dir = exp_dict['base_dir'] if 'base_dir' in exp_dict else None
             mainfile = exp_dict['mainfile'] if 'mainfile' in exp_dict else None
             sources = exp_dict['sources'] if 'sources' in exp_dict else None
@@ -131,6 +158,13 @@ class DetailsDialog(QtWidgets.QDialog):
 
         self._files_list.selectionModel().selectionChanged.connect(self._update_preview_buttons)
 
+    def _update_files_label(self):
+        if self._filesystem is None:
+            return
+        stats = self._filesystem.get_cache_statistics()
+        self._files_label.setText('Attached Files (cache: %d hits, %d from disk, %d misses, %d files / %s in memory)' % 
+                (stats['hits'],stats['spill_hits'],stats['misses'],stats['entries'],format_size(stats['bytes'])))
+
     def _update_preview_buttons(self):
         selected_indexes = self._files_list.selectedIndexes()
         assert len(selected_indexes) <= 1
@@ -147,9 +181,22 @@ class DetailsDialog(QtWidgets.QDialog):
         self._config_display.setPlainText(str(this_config_data))
 
     def _slot_show_entry_data(self,index):
-        this_key = str(self._entry_model.data(index))
-        this_detail_data = self._experiment.get_details()[this_key]
-        self._entry_display.setPlainText(str(this_detail_data))
+        this_key = self._entry_model.data(index,KeyRole)
+        # the output of running experiments is always shown in the large text viewer, which can follow it
+        followable = this_key == 'captured_out' and self._experiment.get_status() == 'RUNNING'
+        if self._entry_model.data(index,TypeRole) == 'string' and (followable or self._entry_model.data(index,SizeRole) > Config.LargeTextSize):
+            self._large_text_viewer.set_source(LargeTextViewer.ExperimentTextSource(self._experiment,this_key),followable=followable)
+            self._entry_stack.setCurrentWidget(self._large_text_viewer)
+        else:
+            this_detail_data = self._get_entry_value(this_key)
+            self._entry_display.setPlainText(str(this_detail_data))
+            self._entry_stack.setCurrentWidget(self._entry_display)
+            self._large_text_viewer.set_source(None)
+
+    def _get_entry_value(self,key):
+        if key not in self._entry_values:
+            self._entry_values[key] = self._experiment.load_detail_value(key)
+        return self._entry_values[key]
 
     def _slot_display_preview(self):
         # double-click on file
@@ -165,8 +212,8 @@ class DetailsDialog(QtWidgets.QDialog):
     def _slot_save_button_clicked(self):
         self._try_save_file()
 
-    # returns current file name (without dirrectory) and data
-    def _get_current_file_data(self):
+    # returns current file name (as stored in the database), or None
+    def _get_current_filename(self):
         selected_indexes = self._files_list.selectedIndexes()
         assert len(selected_indexes) <= 1
         if len(selected_indexes) == 0:
@@ -174,19 +221,20 @@ class DetailsDialog(QtWidgets.QDialog):
 
         the_index = selected_indexes[0]
         the_item = self._files_model.itemFromIndex(the_index)
-        filename = the_item.data(FilenameRole)
-        basename = os.path.basename(filename)
-
-        data = self._filesystem.get_file(filename)
-        decoded_data = data.decode('utf-8', 'backslashreplace')
-        return (basename,decoded_data)
+        return the_item.data(FilenameRole)
 
     def _display_preview(self):
-        basename_and_data = self._get_current_file_data()
-        if basename_and_data is None:
+        filename = self._get_current_filename()
+        if filename is None:
             return
-        else:
-            basename,data = basename_and_data
+        basename = os.path.basename(filename)
+
+        # only the beginning of the file is loaded
+        head,truncated = self._filesystem.read_file_head(filename,Config.FilePreviewSize)
+        self._update_files_label()
+        data = head.decode('utf-8', 'backslashreplace')
+        if truncated:
+            data += '\n\n[... preview truncated after %s, save the file to see all of it]' % format_size(len(head))
 
         display_dialog = QtWidgets.QDialog()
         display_dialog.setWindowTitle('Display attachment ' + basename)
@@ -209,11 +257,10 @@ class DetailsDialog(QtWidgets.QDialog):
         display_dialog.exec_()
 
     def _try_save_file(self):
-        basename_and_data = self._get_current_file_data()
-        if basename_and_data is None:
+        filename = self._get_current_filename()
+        if filename is None:
             return
-        else:
-            basename,data = basename_and_data
+        basename = os.path.basename(filename)
 
         last_save_directory = self._app.settings.value('Global/lastSaveDirectory')
         if last_save_directory is None:
@@ -230,8 +277,15 @@ class DetailsDialog(QtWidgets.QDialog):
         self._app.settings.setValue('Global/lastSaveDirectory',dir_name)
 
         print('Will now save to',save_file_name)
-        fp = open(save_file_name,'wt') # TODO always assumes text?
-        print(data,file=fp)
-        fp.close()
+        # the file is copied chunk by chunk, unchanged
+        progress_dialog = QtWidgets.QProgressDialog('Saving ' + basename,'&Cancel',0,100,self)
+        progress_dialog.setWindowModality(QtCore.Qt.WindowModal)
+        progress_dialog.setMinimumDuration(500)
+        def progress(bytes_written,total_bytes):
+            progress_dialog.setValue(100 * bytes_written // max(total_bytes,1))
+            return not progress_dialog.wasCanceled()
+        self._filesystem.save_file(filename,save_file_name,progress)
+        progress_dialog.reset()
+        self._update_files_label()
 
 
@@ -0,0 +1,101 @@
+# This file contains the field index of a study, which keeps track of all config and result fields of the
+# experiments of the study. It is updated whenever an experiment is created, reloaded, or deleted (see
+# SacredStudy and SacredExperiment), so that the field lists need not be recomputed from all experiments.
+#
+# Each field has a reference count (the number of experiments which have this field) and the types of the values
+# which were seen for this field, starting with the type of the first value. Types are not forgotten when values
+# change, only when the field vanishes. Fields are identified as in BrowserState.Fields, i.e. as (FieldType, name).
+# The fields of an experiment are passed as a shape (see ColumnStore).
+#
+# Additionally, the index records which fields appeared or vanished since the last call to take_changes.
+
+from . import BrowserState
+from . import ColumnStore
+
+class FieldIndex:
+    def __init__(self):
+        # field -> reference count
+        self._fields = {}
+        # field -> list of value types, the first one is the type of the first value
+        self._types = {}
+        # sorted field names per field type, missing if they must be recomputed
+        self._sorted_names = {}
+
+        self._appeared = set()
+        self._vanished = set()
+
+    # Update the index after the fields of an experiment have changed from old_shape to new_shape, new_values
+    # are the values of the experiment (in the order of new_shape)
+    def replace(self,old_shape,new_shape,new_values):
+        # the shapes are usually the same when experiments are reloaded
+        if old_shape is not new_shape:
+            for field in old_shape.fields:
+                if field not in new_shape.field_set:
+                    self._decrement(field)
+            for field in new_shape.fields:
+                if field not in old_shape.field_set:
+                    self._increment(field)
+        for field,value in zip(new_shape.fields,new_values):
+            types = self._types.get(field)
+            if types is None:
+                self._types[field] = [ type(value) ]
+            elif type(value) not in types:
+                types.append(type(value))
+
+    def remove(self,shape):
+        self.replace(shape,ColumnStore.EmptyShape,())
+
+    def list_config_fields(self):
+        return self._list_names(BrowserState.Fields.FieldType.Config)
+
+    def list_result_fields(self):
+        return self._list_names(BrowserState.Fields.FieldType.Result)
+
+    # Number of experiments which have the given field
+    def get_field_count(self,field):
+        return self._fields.get(field,0)
+
+    # Type of the first value which was seen for the field, or None if the field is unknown
+    def get_field_type(self,field):
+        types = self._types.get(field)
+        return types[0] if types is not None else None
+
+    # All types of values which were seen for the field (empty if the field is unknown)
+    def get_field_types(self,field):
+        return tuple(self._types.get(field,()))
+
+    # Returns (appeared fields, vanished fields) since the last call, both sorted
+    def take_changes(self):
+        result = (sorted(self._appeared),sorted(self._vanished))
+        self._appeared = set()
+        self._vanished = set()
+        return result
+
+    ############# Internals #############
+    def _increment(self,field):
+        count = self._fields.get(field,0)
+        self._fields[field] = count + 1
+        if count == 0:
+            self._sorted_names.pop(field[0],None)
+            if field in self._vanished:
+                self._vanished.remove(field)
+            else:
+                self._appeared.add(field)
+
+    def _decrement(self,field):
+        count = self._fields[field] - 1
+        if count > 0:
+            self._fields[field] = count
+        else:
+            del self._fields[field]
+            self._types.pop(field,None)
+            self._sorted_names.pop(field[0],None)
+            if field in self._appeared:
+                self._appeared.remove(field)
+            else:
+                self._vanished.add(field)
+
+    def _list_names(self,field_type):
+        if field_type not in self._sorted_names:
+            self._sorted_names[field_type] = sorted(name for tp,name in self._fields.keys() if tp == field_type)
+        return list(self._sorted_names[field_type])
@@ -0,0 +1,108 @@
+# This file implements a cache for the contents of files from GridFS (sources and artifacts), which are
+# often opened repeatedly (Sacred stores each source file only once, and many runs refer to it). Contents of
+# files up to a maximum size are kept in memory up to a total size (least recently used files are discarded first). Optionally, discarded
+# contents are spilled to a directory on disk, which is likewise limited in size.
+#
+# Keys should identify the content: the md5 of the file if known, otherwise its GridFS file id.
+
+from . import Config
+
+import collections
+import hashlib
+import os
+
+class FileCache:
+    def __init__(self,max_bytes,max_file_bytes,spill_directory=None,max_spill_bytes=0):
+        self._max_bytes = max_bytes
+        self._max_file_bytes = max_file_bytes
+        self._spill_directory = spill_directory
+        self._max_spill_bytes = max_spill_bytes
+
+        self._contents = collections.OrderedDict() # key -> bytes, in LRU order
+        self._total_bytes = 0
+
+        self._hits = 0
+        self._spill_hits = 0
+        self._misses = 0
+
+        if self._spill_directory is not None:
+            os.makedirs(self._spill_directory,exist_ok=True)
+
+    # Returns the content for the given key, or None
+    def get(self,key):
+        data = self._contents.get(key)
+        if data is not None:
+            self._contents.move_to_end(key)
+            self._hits += 1
+            return data
+
+        data = self._load_spilled(key)
+        if data is not None:
+            self._spill_hits += 1
+            self.put(key,data)
+            return data
+
+        self._misses += 1
+        return None
+
+    # Store the content for the given key, unless it is larger than max_file_bytes
+    def put(self,key,data):
+        if len(data) > self._max_file_bytes or len(data) > self._max_bytes:
+            return
+        if key in self._contents:
+            self._total_bytes -= len(self._contents.pop(key))
+        self._contents[key] = data
+        self._total_bytes += len(data)
+        while self._total_bytes > self._max_bytes:
+            old_key,old_data = self._contents.popitem(last=False)
+            self._total_bytes -= len(old_data)
+            self._spill(old_key,old_data)
+
+    # Returns a dictionary with hits (in memory), spill_hits (on disk), misses, entries, and bytes (in memory)
+    def get_statistics(self):
+        return { 'hits': self._hits, 'spill_hits': self._spill_hits, 'misses': self._misses,
+                'entries': len(self._contents), 'bytes': self._total_bytes }
+
+    ############# Internals #############
+    def _spill_filename(self,key):
+        return os.path.join(self._spill_directory,hashlib.sha1(repr(key).encode('utf-8')).hexdigest())
+
+    def _spill(self,key,data):
+        if self._spill_directory is None or len(data) > self._max_spill_bytes:
+            return
+        try:
+            with open(self._spill_filename(key),'wb') as fp:
+                fp.write(data)
+            self._limit_spill_directory()
+        except OSError as e:
+            print('Could not spill file to cache directory:',str(e))
+
+    def _load_spilled(self,key):
+        if self._spill_directory is None:
+            return None
+        try:
+            with open(self._spill_filename(key),'rb') as fp:
+                return fp.read()
+        except OSError:
+            return None
+
+    # remove the oldest spilled files until the directory is small enough
+    def _limit_spill_directory(self):
+        entries = [ e for e in os.scandir(self._spill_directory) if e.is_file() ]
+        entries.sort(key=lambda e: e.stat().st_mtime)
+        total_bytes = sum(e.stat().st_size for e in entries)
+        for entry in entries:
+            if total_bytes <= self._max_spill_bytes:
+                break
+            total_bytes -= entry.stat().st_size
+            os.remove(entry.path)
+
+_file_cache = None
+
+# Returns the (singleton) file cache, which is shared by all file systems
+def get_file_cache():
+    global _file_cache
+    if _file_cache is None:
+        spill_directory = os.path.join(os.getenv('HOME'),Config.FileCacheSpillDirectory) if Config.FileCacheSpillDirectory is not None else None
+        _file_cache = FileCache(Config.FileCacheSize,Config.FileCacheMaxFileSize,spill_directory,Config.FileCacheSpillSize)
+    return _file_cache
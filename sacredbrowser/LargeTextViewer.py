@@ -0,0 +1,229 @@
+from . import Config
+
+from PyQt5 import QtCore, QtGui, QtWidgets
+
+import collections
+
+# Source of text for the LargeTextViewer: a top-level string value of an experiment document (e.g. captured_out),
+# which is loaded chunk by chunk from the server (see SacredStudy.load_experiment_text_chunk).
+class ExperimentTextSource:
+    def __init__(self,experiment,key):
+        self._study = experiment.get_study()
+        self._obid = experiment.id()
+        self._key = key
+        self._last_heartbeat = experiment.get_heartbeat()
+
+    def length(self):
+        return self._study.load_experiment_text_length(self._obid,self._key)
+
+    def load_chunk(self,start,count):
+        return self._study.load_experiment_text_chunk(self._obid,self._key,start,count)
+
+    def find(self,text,start):
+        return self._study.find_experiment_text(self._obid,self._key,text,start)
+
+    # For running experiments: returns (length, running), where length is None if the text cannot have
+    # changed since the last call (since the heartbeat has not changed)
+    def poll(self):
+        heartbeat,status = self._study.load_experiment_heartbeat(self._obid)
+        running = status == 'RUNNING'
+        if heartbeat is not None and heartbeat == self._last_heartbeat:
+            return (None,running)
+        self._last_heartbeat = heartbeat
+        return (self.length(),running)
+
+# This widget displays a (very large) text which is never completely loaded. The text is divided into chunks
+# of Config.TextChunkSize characters, only the current chunk is displayed, and the scroll bar on the right
+# moves between chunks. A few chunks are cached. Searching is done by the source (i.e. by the server).
+#
+# If the text belongs to a running experiment, it can be followed: the source is polled for new text, which
+# is appended, and the view is kept at the end of the text.
+class LargeTextViewer(QtWidgets.QWidget):
+    MaxCachedChunks = 16
+
+    ############# Public interface #############
+    def __init__(self):
+        super().__init__()
+
+        self._source = None
+        self._length = 0
+        self._current_chunk = 0
+        self._chunks = collections.OrderedDict() # chunk number -> text, in LRU order
+
+        # make subwidgets
+        self._text_display = QtWidgets.QPlainTextEdit()
+        self._text_display.setReadOnly(True)
+        self._chunk_scroll_bar = QtWidgets.QScrollBar(QtCore.Qt.Vertical)
+        self._chunk_scroll_bar.setPageStep(1)
+        self._position_label = QtWidgets.QLabel()
+
+        self._start_button = QtWidgets.QPushButton('S&tart')
+        self._end_button = QtWidgets.QPushButton('&End')
+        self._search_edit = QtWidgets.QLineEdit()
+        self._search_edit.setPlaceholderText('Search')
+        self._find_button = QtWidgets.QPushButton('&Find next')
+        self._follow_checkbox = QtWidgets.QCheckBox('F&ollow')
+
+        self._follow_timer = QtCore.QTimer(self)
+        self._follow_timer.setInterval(Config.TextFollowInterval)
+
+        # layout
+        self._text_layout = QtWidgets.QHBoxLayout()
+        self._text_layout.addWidget(self._text_display)
+        self._text_layout.addWidget(self._chunk_scroll_bar)
+
+        self._button_layout = QtWidgets.QHBoxLayout()
+        self._button_layout.addWidget(self._position_label)
+        self._button_layout.addStretch()
+        self._button_layout.addWidget(self._start_button)
+        self._button_layout.addWidget(self._end_button)
+        self._button_layout.addWidget(self._search_edit)
+        self._button_layout.addWidget(self._find_button)
+        self._button_layout.addWidget(self._follow_checkbox)
+
+        self._main_layout = QtWidgets.QVBoxLayout()
+        self._main_layout.setContentsMargins(0,0,0,0)
+        self._main_layout.addLayout(self._text_layout)
+        self._main_layout.addLayout(self._button_layout)
+        self.setLayout(self._main_layout)
+
+        # connections
+        self._chunk_scroll_bar.valueChanged.connect(self._slot_chunk_selected)
+        self._start_button.clicked.connect(self.jump_to_start)
+        self._end_button.clicked.connect(self.jump_to_end)
+        self._search_edit.returnPressed.connect(self.find_next)
+        self._find_button.clicked.connect(self.find_next)
+        self._follow_checkbox.toggled.connect(self._slot_follow_toggled)
+        self._follow_timer.timeout.connect(self._slot_follow_timeout)
+
+        self._set_followable(False)
+
+    # Set the source (see ExperimentTextSource), or None. If followable is set, the text can be followed while
+    # it is growing (the source must support poll).
+    def set_source(self,source,followable=False):
+        self._set_followable(followable)
+        self._source = source
+        self._chunks.clear()
+        self._length = source.length() if source is not None else 0
+        self._update_scroll_bar()
+        self._chunk_scroll_bar.blockSignals(True)
+        self._chunk_scroll_bar.setValue(0)
+        self._chunk_scroll_bar.blockSignals(False)
+        self._show_chunk(0)
+
+    def jump_to_start(self):
+        self._chunk_scroll_bar.setValue(0)
+        self._text_display.moveCursor(QtGui.QTextCursor.Start)
+
+    def jump_to_end(self):
+        self._chunk_scroll_bar.setValue(self._chunk_scroll_bar.maximum())
+        self._text_display.moveCursor(QtGui.QTextCursor.End)
+
+    # Find the search text after the current cursor position, wraps around at the end of the text
+    def find_next(self):
+        text = self._search_edit.text()
+        if self._source is None or len(text) == 0:
+            return
+        start = self._current_chunk * Config.TextChunkSize + self._text_display.textCursor().position() + 1
+        pos = self._source.find(text,start)
+        if pos < 0 and start > 0:
+            pos = self._source.find(text,0)
+        if pos < 0:
+            self._position_label.setText('Not found: ' + text)
+            return
+        self._select_range(pos,len(text))
+
+    ############# Internals #############
+    def _chunk_count(self):
+        return max(1,(self._length + Config.TextChunkSize - 1) // Config.TextChunkSize)
+
+    def _update_scroll_bar(self):
+        self._chunk_scroll_bar.blockSignals(True)
+        self._chunk_scroll_bar.setRange(0,self._chunk_count() - 1)
+        self._chunk_scroll_bar.blockSignals(False)
+        self._chunk_scroll_bar.setVisible(self._chunk_count() > 1)
+
+    def _get_chunk(self,chunk_no):
+        if chunk_no in self._chunks:
+            self._chunks.move_to_end(chunk_no)
+        else:
+            self._chunks[chunk_no] = self._source.load_chunk(chunk_no * Config.TextChunkSize,Config.TextChunkSize)
+            while len(self._chunks) > self.MaxCachedChunks:
+                self._chunks.popitem(last=False)
+        return self._chunks[chunk_no]
+
+    def _show_chunk(self,chunk_no):
+        self._current_chunk = chunk_no
+        if self._source is None:
+            self._text_display.setPlainText('')
+            self._position_label.setText('')
+            return
+        self._text_display.setPlainText(self._get_chunk(chunk_no))
+        self._update_position_label()
+
+    def _update_position_label(self):
+        first = self._current_chunk * Config.TextChunkSize
+        last = min(first + Config.TextChunkSize,self._length)
+        self._position_label.setText('Characters %d-%d of %d' % (first,last,self._length))
+
+    def _set_followable(self,followable):
+        self._follow_checkbox.setChecked(False)
+        self._follow_checkbox.setVisible(followable)
+
+    # Load the text which has been added since the last update, and append it
+    def _append_text(self,new_length):
+        old_length = self._length
+        if new_length < old_length:
+            # the text has been replaced, start over
+            self.set_source(self._source,followable=True)
+            self._follow_checkbox.setChecked(True)
+            return
+
+        new_text = self._source.load_chunk(old_length,new_length - old_length)
+        self._length = old_length + len(new_text)
+
+        # the part of the new text which belongs to the chunk containing the old end of the text, the rest
+        # is loaded when the following chunks are shown
+        last_chunk = old_length // Config.TextChunkSize
+        last_chunk_text = new_text[:(last_chunk + 1) * Config.TextChunkSize - old_length]
+        if last_chunk in self._chunks:
+            self._chunks[last_chunk] += last_chunk_text
+        if self._current_chunk == last_chunk and len(last_chunk_text) > 0:
+            cursor = QtGui.QTextCursor(self._text_display.document())
+            cursor.movePosition(QtGui.QTextCursor.End)
+            cursor.insertText(last_chunk_text)
+
+        self._update_scroll_bar()
+        self._update_position_label()
+        if self._follow_checkbox.isChecked():
+            self.jump_to_end()
+
+    # Show the chunk containing pos, and select count characters from there (as far as they are in the chunk)
+    def _select_range(self,pos,count):
+        chunk_no = pos // Config.TextChunkSize
+        self._chunk_scroll_bar.setValue(chunk_no) # shows the chunk, if it is not shown already
+        offset = pos - chunk_no * Config.TextChunkSize
+        cursor = self._text_display.textCursor()
+        cursor.setPosition(offset)
+        cursor.setPosition(min(offset + count,len(self._text_display.toPlainText())),QtGui.QTextCursor.KeepAnchor)
+        self._text_display.setTextCursor(cursor)
+        self._text_display.ensureCursorVisible()
+
+    def _slot_chunk_selected(self,chunk_no):
+        if chunk_no != self._current_chunk:
+            self._show_chunk(chunk_no)
+
+    def _slot_follow_toggled(self,checked):
+        if checked and self._source is not None:
+            self.jump_to_end()
+            self._follow_timer.start()
+        else:
+            self._follow_timer.stop()
+
+    def _slot_follow_timeout(self):
+        new_length,running = self._source.poll()
+        if new_length is not None and new_length != self._length:
+            self._append_text(new_length)
+        if not running:
+            # the text will not change any more
+            self._set_followable(False)
@@ -0,0 +1,58 @@
+# This file implements a persistent cache of experiment skeletons (flattened config and result, status, and
+# heartbeat), stored in a local SQLite database. When a study is opened, it is first populated from the cache,
+# and then checked against the server (see SacredStudy.load_in_background), so that reopening a large study
+# does not require to transfer all experiments again.
+#
+# Entries are keyed by the qualified id of the study and the _id of the experiment. Both the _id and the
+# skeleton are pickled.
+#
+# The cache is updated by the fetchers on the worker thread of the BackgroundLoader, so the connection is shared
+# between threads and guarded by a lock.
+
+from . import Config
+
+import sqlite3
+import threading
+import pickle
+import os
+
+# fixed protocol, so that the pickled _id (which is part of the key) never changes
+PickleProtocol = 4
+
+class SkeletonCache:
+    def __init__(self,filename):
+        self._db = sqlite3.connect(filename,check_same_thread=False)
+        self._lock = threading.Lock()
+        self._db.execute('CREATE TABLE IF NOT EXISTS skeletons (study TEXT NOT NULL, obid BLOB NOT NULL, skeleton BLOB NOT NULL, PRIMARY KEY (study, obid))')
+        self._db.commit()
+
+    # Returns a dictionary from _id to skeleton (config, result, status, heartbeat) for the given study
+    def load_study(self,study_id):
+        with self._lock:
+            rows = self._db.execute('SELECT obid, skeleton FROM skeletons WHERE study = ?',(study_id,)).fetchall()
+        return { pickle.loads(obid): pickle.loads(skeleton) for obid,skeleton in rows }
+
+    # Store the given skeletons (a dictionary from _id to skeleton), and remove the experiments with the given _ids
+    def update_study(self,study_id,skeletons,removed_obids):
+        with self._lock, self._db:
+            self._db.executemany('INSERT OR REPLACE INTO skeletons (study, obid, skeleton) VALUES (?, ?, ?)',
+                    ((study_id,pickle.dumps(k,protocol=PickleProtocol),pickle.dumps(v,protocol=PickleProtocol)) for k,v in skeletons.items()))
+            self._db.executemany('DELETE FROM skeletons WHERE study = ? AND obid = ?',
+                    ((study_id,pickle.dumps(k,protocol=PickleProtocol)) for k in removed_obids))
+
+    def clear_study(self,study_id):
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM skeletons WHERE study = ?',(study_id,))
+
+_skeleton_cache = None
+
+# Returns the (singleton) skeleton cache, or None if the cache is disabled or cannot be opened
+def get_skeleton_cache():
+    global _skeleton_cache
+    if _skeleton_cache is None and Config.UseSkeletonCache:
+        try:
+            _skeleton_cache = SkeletonCache(os.path.join(os.getenv('HOME'),Config.SkeletonCacheFile))
+        except sqlite3.Error as e:
+            print('Could not open skeleton cache:',str(e))
+            Config.UseSkeletonCache = False
+    return _skeleton_cache
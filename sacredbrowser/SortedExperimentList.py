@@ -1,14 +1,17 @@
 # This file implements a sorted list of experiments. It takes input signals from Browserstate.SortOrder and
 # BrowserState.CurrentStudy, as well as from the respective current study object.
 
+from . import BackgroundLoader
 from . import BrowserState
 from . import DbEntries
 from . import Utilities
 
 from PyQt5 import QtCore
 
+import bisect
 import functools
 import numbers
+import datetime
 
 ChangeType = Utilities.ChangeType
 ChangeData = Utilities.ChangeData
@@ -71,10 +74,25 @@ class SortedExperimentList(QtCore.QObject):
         deleter = lambda exp: None
         self._sorted_experiments = Utilities.ObjectHolder(pre_change_emit=pre_change_emit,post_change_emit=post_change_emit,loader=loader,deleter=deleter)
 
+        # the sort items (see _make_sort_item) of the sorted experiments, as a sorted list and by ID, so that
+        # changes can be merged without sorting again. None while the server is sorting the experiments.
+        self._sorted_items = []
+        self._items_by_id = {}
+        # IDs of experiments which are being removed from the study
+        self._removed_ids = []
+        # results of outdated server sorts are discarded by comparing the generation
+        self._server_sort_pending = False
+        self._server_sort_generation = 0
+        # set if the server should sort the experiments when the study has been loaded
+        self._server_sort_deferred = False
+
     # Yields output
     def get_sorted_experiments(self):
         return [ self._browser_state.current_study.get_study().get_experiment(obid)[1] for obid in self._sorted_experiments.list_keys() ]
 
+    def get_experiment_count(self):
+        return self._sorted_experiments.count()
+
     def get_sorted_experiment_at(self,pos):
         return self._browser_state.current_study.get_study().get_experiment(self._sorted_experiments.get_by_position(pos)[0])[1]
 
@@ -84,59 +102,201 @@ class SortedExperimentList(QtCore.QObject):
         if old_study is not None:
             old_study.experiments_to_be_changed.disconnect(self._slot_experiments_to_be_changed_closure)
             old_study.experiments_changed.disconnect(self._slot_experiments_changed_closure)
+            old_study.load_finished.disconnect(self._slot_study_load_finished)
 
     def _slot_study_changed(self):
         new_study = self._browser_state.current_study.get_study()
         if new_study is not None:
             new_study.experiments_to_be_changed.connect(self._slot_experiments_to_be_changed_closure)
             new_study.experiments_changed.connect(self._slot_experiments_changed_closure)
+            new_study.load_finished.connect(self._slot_study_load_finished)
+        self._removed_ids = []
+        self._resort(use_server=True)
+
+    # the server is only asked for the order when the study has been loaded (see _resort)
+    def _slot_study_load_finished(self,study):
+        if self._server_sort_deferred:
+            self._resort(use_server=True)
 
     def _slot_sort_order_to_be_changed(self):
         pass
 
     def _slot_sort_order_changed(self):
-        self._resort()
+        self._resort(use_server=True)
 
     def _slot_experiments_to_be_changed(self,study,change_data):
-        pass
+        # the IDs of removed experiments are no longer known after the change
+        if change_data.tp == ChangeType.Remove:
+            pos,cnt = change_data.info
+            self._removed_ids.extend(study.get_experiment_id_at(p) for p in range(pos,pos + cnt))
 
     def _slot_experiments_changed(self,study,change_data):
-        self._resort()
+        removed_ids = self._removed_ids
+        self._removed_ids = []
+        if change_data.tp == ChangeType.Reset or self._server_sort_pending or self._sorted_items is None:
+            self._resort(use_server=False)
+        elif change_data.tp == ChangeType.Insert:
+            self._merge([],change_data.info[2])
+        elif change_data.tp == ChangeType.Remove:
+            self._merge(removed_ids,[])
+        elif change_data.tp == ChangeType.Content:
+            self._merge(change_data.info[1],change_data.info[1])
+
+        if change_data.tp == ChangeType.Content:
+            # the changed experiments must be redrawn even if their position has not changed
+            self._sorted_experiments.notify_content_changed(change_data.info[1])
+
+    # Get the list of all experiments and sort it, the result is merged using the ObjectHolder. If use_server is
+    # set, the server is asked to sort the experiments in the background instead (if possible, see
+    # _start_server_sort). This is only done when the study or the sort order has changed (or the study has been
+    # loaded), changes of the experiments are merged into the sorted list (see _merge).
+    def _resort(self,use_server):
+        self._server_sort_generation += 1 # discard the result of a running server sort
+        self._server_sort_pending = False
+        if use_server:
+            self._server_sort_deferred = False
 
-    # get list of all experiments, sort, and merge using the ObjectHolder
-    def _resort(self):
         current_study = self._browser_state.current_study.get_study()
-        if current_study is not None:
-            exp_list = self._browser_state.current_study.get_study().get_all_experiments()
+        # an uninitialized study would be loaded synchronously, its experiments arrive when it is loaded
+        if current_study is not None and (current_study.is_initialized() or current_study.is_loading()):
+            exp_list = current_study.get_all_experiments()
         else:
             exp_list = []
         sort_order = self._browser_state.sort_order.get_order()
-        new_sorted_list = self._sort_exp_list(exp_list,sort_order)
-        self._sorted_experiments.update(new_sorted_list)
+        # While the study is being loaded, the server would be asked for a new order after every batch, so this
+        # is deferred until loading has finished (see _slot_study_load_finished)
+        if use_server and current_study is not None and len(sort_order) > 0:
+            if current_study.is_loading():
+                self._server_sort_deferred = True
+            elif self._start_server_sort(current_study,exp_list,sort_order):
+                return
 
+        self._sorted_items = self._sort_exp_list(exp_list,sort_order)
+        self._items_by_id = { item[-1]: item for item in self._sorted_items }
+        self._sorted_experiments.update([ item[-1] for item in self._sorted_items ])
 
-    # Sort the list of experiments accoring to the given order. Returns the IDs of the sorted experiments.
-    @staticmethod
-    def _sort_exp_list(exp_list,order):
-        # make a list which is suitable for sorting
-        filtered_exp_data = []
-        for exp in exp_list:
-            this_item = []
-            for k in order:
-                try:
-                    this_el = exp.get_field(k)
-                except KeyError:
-                    this_el = None
-                this_item.append(SortItem(this_el))
-            # finally append the ID, which is not important for sorting, but we need it later on
-            # to indentify our experiments
-            this_item.append(exp.id())
-            filtered_exp_data.append(this_item)
+    # Merge changes of the experiments into the sorted list: the sort items of removed_ids are taken out, and
+    # those of inserted_ids are computed and inserted at their positions (by bisection). Changed experiments
+    # appear in both lists.
+    def _merge(self,removed_ids,inserted_ids):
+        # a complete sort is cheaper if a large part of the list has changed
+        if len(removed_ids) + len(inserted_ids) > len(self._sorted_items) // 8:
+            self._resort(use_server=False)
+            return
+
+        current_study = self._browser_state.current_study.get_study()
+        sort_order = self._browser_state.sort_order.get_order()
+        for obid in removed_ids:
+            item = self._items_by_id.pop(obid,None)
+            if item is None:
+                continue
+            pos = bisect.bisect_left(self._sorted_items,item)
+            if pos >= len(self._sorted_items) or self._sorted_items[pos] is not item:
+                # values which do not compare equal to themselves (NaN) defeat the bisection
+                pos = next(p for p,x in enumerate(self._sorted_items) if x is item)
+            del self._sorted_items[pos]
+        for obid in inserted_ids:
+            item = self._make_sort_item(current_study.get_experiment(obid)[1],sort_order)
+            self._items_by_id[obid] = item
+            bisect.insort(self._sorted_items,item)
+        self._sorted_experiments.update([ item[-1] for item in self._sorted_items ])
 
-        # perform sorting
-        filtered_exp_data.sort()
+    # Let the server sort the experiments in the background, which is possible if all sort fields correspond to
+    # document paths, and if the server order is the same as the one from _sort_exp_list. This is the case if each
+    # field has values of a single type (missing values are only permitted for numbers, since for strings, the
+    # placeholder for missing values would be sorted differently). The value types are taken from the field index
+    # of the study. Returns False if the server cannot be used.
+    # Until the result arrives, the experiments keep their previous order. When it arrives, the sort items
+    # are rebuilt in the server order (which includes the _id, as the local order), so that further changes
+    # are merged as usual.
+    def _start_server_sort(self,study,exp_list,order):
+        # result fields are checked by the fetcher, which knows how the results are stored
+        if None in [ DbEntries.mongo_path_for_field(k,set()) for k in order ]:
+            return False
+
+        field_index = study.get_field_index()
+        for k in order:
+            value_types = set(SortedExperimentList._get_server_sort_type(tp) for tp in field_index.get_field_types(k))
+            if field_index.get_field_count(k) < len(exp_list):
+                value_types.add('missing')
+            permitted = (value_types <= { 'number', 'missing' } or value_types <= { 'number', 'null' } or
+                    (len(value_types) == 1 and value_types <= { 'string', 'bool', 'date' }))
+            if not permitted:
+                return False
+
+        fetcher = study.make_sorted_ids_fetcher(order)
+        generation = self._server_sort_generation
+        known_ids = [ exp.id() for exp in exp_list ]
 
-        return [ x[-1] for x in filtered_exp_data ]
+        def receiver(sorted_ids):
+            if generation != self._server_sort_generation:
+                return
+            self._server_sort_pending = False
+            if sorted_ids is not None:
+                # the server may already know about experiments which have not been loaded yet (or vice versa)
+                known_id_set = set(known_ids)
+                sorted_ids = [ x for x in sorted_ids if x in known_id_set ]
+                if len(sorted_ids) == len(known_id_set):
+                    current_study = self._browser_state.current_study.get_study()
+                    self._sorted_items = [ self._make_sort_item(current_study.get_experiment(obid)[1],order) for obid in sorted_ids ]
+                    self._items_by_id = { item[-1]: item for item in self._sorted_items }
+                    self._sorted_experiments.update(sorted_ids)
+                    return
+            self._resort(use_server=False)
 
+        def finisher(error):
+            if generation != self._server_sort_generation or not self._server_sort_pending:
+                return
+            self._server_sort_pending = False
+            if error is not None:
+                print('Sorting on server failed (%s), sorting locally' % str(error))
+            self._resort(use_server=False)
 
+        # the list must not show experiments of another study in the meantime
+        if set(self._sorted_experiments.list_keys()) != set(known_ids):
+            self._sorted_experiments.update(known_ids)
+        self._sorted_items = None
+        self._items_by_id = None
+        self._server_sort_pending = True
+        BackgroundLoader.get_background_loader().submit(fetcher,receiver,finisher)
+        return True
+
+    # Type alias (in the sense of mongo comparisons) of values of the given python type
+    @staticmethod
+    def _get_server_sort_type(tp):
+        if tp is type(None):
+            return 'null'
+        elif tp is bool:
+            return 'bool'
+        elif issubclass(tp,numbers.Number):
+            return 'number'
+        elif issubclass(tp,str):
+            return 'string'
+        elif issubclass(tp,datetime.datetime):
+            return 'date'
+        else:
+            return 'other'
 
+
+    # Sort the list of experiments accoring to the given order. Returns the sorted list of sort items (see
+    # _make_sort_item).
+    @staticmethod
+    def _sort_exp_list(exp_list,order):
+        sort_items = [ SortedExperimentList._make_sort_item(exp,order) for exp in exp_list ]
+        sort_items.sort()
+        return sort_items
+
+    # Make a list which is suitable for sorting
+    @staticmethod
+    def _make_sort_item(exp,order):
+        this_item = []
+        for k in order:
+            try:
+                this_el = exp.get_field(k)
+            except KeyError:
+                this_el = None
+            this_item.append(SortItem(this_el))
+        # finally append the ID, which is not important for sorting, but we need it later on
+        # to indentify our experiments
+        this_item.append(exp.id())
+        return this_item
@@ -0,0 +1,87 @@
+# This file contains the cache of study statistics (the number of runs and the last heartbeat of each study),
+# which are shown in the study tree. Statistics are computed on a thread pool, so that many studies (of many
+# databases) are queried at the same time, and are recomputed when they are older than Config.StudyStatisticsTTL
+# seconds. Studies are identified by their qualified id.
+
+from . import Config
+
+from PyQt5 import QtCore
+
+import pymongo
+import concurrent.futures
+import collections
+import time
+
+StudyStatistics = collections.namedtuple('StudyStatistics',['run_count','last_heartbeat'])
+
+# Compute the statistics of a runs collection. The run count is taken from the collection metadata, so it is
+# cheap but may be slightly off after an unclean shutdown of the server.
+def load_statistics(collection):
+    run_count = collection.estimated_document_count()
+    result = list(collection.aggregate([ { '$group': { '_id': None, 'last_heartbeat': { '$max': '$heartbeat' } } } ]))
+    last_heartbeat = result[0]['last_heartbeat'] if len(result) > 0 else None
+    return StudyStatistics(run_count,last_heartbeat)
+
+class StudyStatisticsCache(QtCore.QObject):
+    # key, statistics or None - emitted from the worker threads, received on the main thread
+    _statistics_ready = QtCore.pyqtSignal(object,object)
+
+    def __init__(self,ttl,thread_count,parent=None):
+        super().__init__(parent)
+        self._ttl = ttl
+        self._executor = concurrent.futures.ThreadPoolExecutor(thread_count)
+        self._entries = {} # key -> (timestamp, statistics)
+        self._pending = {} # key -> callback
+
+        self._statistics_ready.connect(self._slot_statistics_ready)
+
+        app = QtCore.QCoreApplication.instance()
+        if app is not None:
+            app.aboutToQuit.connect(self.shutdown)
+
+    # Returns the statistics for the given key, or None if they have never been computed. If they are unknown
+    # or outdated, they are (re)computed from the collection, and callback is called with the new statistics
+    # (on the main thread). Must be called from the main thread.
+    def get(self,key,collection,callback):
+        entry = self._entries.get(key)
+        if entry is None or time.time() - entry[0] > self._ttl:
+            if key not in self._pending:
+                self._executor.submit(self._compute,key,collection)
+            self._pending[key] = callback
+        return entry[1] if entry is not None else None
+
+    # Forget the statistics for the given key, and do not call the callback of a running computation
+    def invalidate(self,key):
+        self._entries.pop(key,None)
+        self._pending.pop(key,None)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+    ############# Internals #############
+    # runs on the thread pool
+    def _compute(self,key,collection):
+        try:
+            statistics = load_statistics(collection)
+        except pymongo.errors.PyMongoError as e:
+            print('Could not compute statistics for %s: %s' % (key,str(e)))
+            statistics = None
+        self._statistics_ready.emit(key,statistics)
+
+    def _slot_statistics_ready(self,key,statistics):
+        callback = self._pending.pop(key,None)
+        if callback is None:
+            return # invalidated in the meantime
+        # failures are remembered as well, so that they are only retried after the TTL
+        self._entries[key] = (time.time(),statistics)
+        if statistics is not None:
+            callback(statistics)
+
+_statistics_cache = None
+
+# Returns the (singleton) statistics cache, which is created on first use
+def get_statistics_cache():
+    global _statistics_cache
+    if _statistics_cache is None:
+        _statistics_cache = StudyStatisticsCache(Config.StudyStatisticsTTL,Config.StudyTreeThreadCount)
+    return _statistics_cache
@@ -0,0 +1,164 @@
+# This file implements live updates of a single study. If the server supports change streams (i.e. it is
+# a replica set or a sharded cluster), a change stream is opened on the runs collection of the study, and
+# every reported insert, update, or delete causes a targeted reload of the affected experiments
+# (see SacredStudy.refresh_experiments_in_background), which in turn emits the usual experiments_changed signals.
+# Otherwise, the study is periodically polled with SacredStudy.load_incremental_in_background. This is also
+# the fallback if the change stream fails, or is invalidated (e.g. because the collection was dropped or renamed).
+#
+# The change stream is opened and read on the worker thread of the background loader (see BackgroundLoader),
+# triggered by a timer on the main thread, using a short await time. The stream object is only used by these
+# jobs (which run one after the other), the main thread merely keeps it between them. No new read is started
+# while a read or a reload is running (the events remain in the change stream until then).
+#
+# For testing against a local single-node replica set, start the server with "mongod --replSet rs0",
+# call rs.initiate() once in the mongo shell, and run this file as a module (from the directory containing
+# the sacredbrowser package), with the mongo URI, database, and study name as arguments:
+#   python -m sacredbrowser.StudyWatcher mongodb://localhost:27017/?replicaSet=rs0 my_database my_study
+
+from . import BackgroundLoader
+from . import Config
+
+from PyQt5 import QtCore
+
+import pymongo
+import pymongo.errors
+
+class StudyWatcher(QtCore.QObject):
+    # Maximum time (ms) which a single poll of the change stream may wait for the server
+    MaxAwaitTime = 10
+
+    def __init__(self,study,parent=None):
+        super().__init__(parent)
+        self._study = study
+        self._stream = None
+        self._use_change_stream = False
+        # set while a read of the change stream is running, results of reads from before the last start or
+        # stop are discarded by comparing the generation
+        self._reading = False
+        self._generation = 0
+
+        self._timer = QtCore.QTimer(self)
+        self._timer.timeout.connect(self._slot_timeout)
+
+    # Start watching. The change stream is opened with the first read, if that fails, the study is polled.
+    def start(self):
+        self.stop()
+        self._use_change_stream = True
+        self._timer.start(Config.StudyWatchInterval)
+
+    def stop(self):
+        self._timer.stop()
+        self._generation += 1
+        self._reading = False
+        if self._stream is not None:
+            self._close_in_background(self._stream)
+            self._stream = None
+
+    def is_using_change_stream(self):
+        return self._use_change_stream
+
+    def _slot_timeout(self):
+        if self._reading or self._study.is_loading() or self._study.is_refreshing():
+            return # changes will be picked up by the running load, or by the next one
+        if self._use_change_stream:
+            self._start_read()
+        else:
+            self._study.load_incremental_in_background()
+
+    # Drain all events which are currently available on the worker thread (opening the stream if necessary), and
+    # reload the affected experiments at once
+    def _start_read(self):
+        stream = self._stream
+        open_stream = self._study.make_change_stream_opener(max_await_time_ms=self.MaxAwaitTime)
+        generation = self._generation
+
+        def fetcher():
+            current_stream = stream if stream is not None else open_stream()
+            changed_ids = set()
+            invalidated = False
+            try:
+                while current_stream.alive:
+                    event = current_stream.try_next()
+                    if event is None:
+                        break
+                    operation = event.get('operationType')
+                    if operation in [ 'insert', 'update', 'replace', 'delete' ]:
+                        changed_ids.add(event['documentKey']['_id'])
+                    elif operation in [ 'drop', 'rename', 'dropDatabase', 'invalidate' ]:
+                        invalidated = True
+                        break
+            except pymongo.errors.PyMongoError:
+                StudyWatcher._close_stream(current_stream)
+                raise
+            if invalidated:
+                StudyWatcher._close_stream(current_stream)
+                current_stream = None
+            yield (current_stream,changed_ids,invalidated)
+
+        def receiver(result):
+            current_stream,changed_ids,invalidated = result
+            if generation != self._generation:
+                # stopped in the meantime
+                if current_stream is not None:
+                    self._close_in_background(current_stream)
+                return
+            self._stream = current_stream
+            if invalidated:
+                print('StudyWatcher: change stream of study %s was invalidated, falling back to polling' % self._study.qualified_id())
+                self._fall_back_to_polling()
+            elif len(changed_ids) > 0:
+                self._study.refresh_experiments_in_background(changed_ids)
+
+        def finisher(error):
+            if generation != self._generation:
+                return
+            self._reading = False
+            if error is not None:
+                print('StudyWatcher: change stream of study %s failed (%s), falling back to polling' % (self._study.qualified_id(),str(error)))
+                self._stream = None
+                self._fall_back_to_polling()
+
+        self._reading = True
+        BackgroundLoader.get_background_loader().submit(fetcher,receiver,finisher)
+
+    def _fall_back_to_polling(self):
+        self._use_change_stream = False
+        self._timer.start(Config.StudyPollInterval)
+        self._study.load_incremental_in_background() # events might have been lost
+
+    # Close the stream on the worker thread, after any running read
+    @staticmethod
+    def _close_in_background(stream):
+        def fetcher():
+            StudyWatcher._close_stream(stream)
+            yield from ()
+        BackgroundLoader.get_background_loader().submit(fetcher,lambda result: None,lambda error: None)
+
+    @staticmethod
+    def _close_stream(stream):
+        try:
+            stream.close()
+        except pymongo.errors.PyMongoError:
+            pass
+
+
+if __name__ == '__main__':
+    from . import DbEntries
+
+    import sys
+
+    def print_change(study,change_data):
+        print('Experiments changed:',change_data)
+
+    app = QtCore.QCoreApplication([])
+    connection = DbEntries.SacredConnection(app)
+    connection.connect(sys.argv[1])
+    # connect() loads the databases in the background, but they are needed right now
+    connection.load_full()
+    study = connection.get_database(sys.argv[2]).get_study(sys.argv[3])
+    study.load_full()
+    study.experiments_changed.connect(print_change)
+
+    watcher = StudyWatcher(study)
+    watcher.start()
+    app.exec_()
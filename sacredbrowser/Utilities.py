@@ -1,4 +1,6 @@
 # from . import BrowserState
+from . import Config
+from . import BlockedList
 
 from PyQt5 import QtCore
 
@@ -9,8 +11,7 @@ import functools
 import numbers
 import sys
 
-# pip install python-Levenshtein
-import Levenshtein
+import bisect
 
 # Parse a string entered by the user into a mongo query dictionary.
 # Raises a ValueError if the query is malformed
@@ -133,7 +134,7 @@ def parse_query(queryText):
 # - Content: info is a list of changed rows
 # - Insert: info is the position where the rows are inserted, the number of inserted rows
 # - Remove: info is the position of the first removed row, and the remove count
-# We permit info to have extra fields (currently used for the levenshtein hack)
+# We permit info to have extra fields (Insert changes from the ObjectHolder carry the list of inserted keys)
 class ChangeType(enum.Enum):
     Reset = 1
     Content = 2
@@ -194,48 +195,87 @@ ChangeData = collections.namedtuple('ChangeData',['tp','info'])
 #     # final field
 #     return this_col[-1]
 
-# Returns the complete list of ChangeData (Insert, Remove, Content) to get from s1 to s2, with as little 
-# insertions/deletions/substitutions as possible. 
+# Returns the list of ChangeData (Remove, Insert) to get from s1 to s2, where both are sequences of unique
+# keys (as in the ObjectHolder). Keys which are in both sequences stay in place as far as possible: the
+# longest common subsequence is found as the longest increasing subsequence of the positions in s1 of the common
+# keys (in the order of s2), which takes O(n log n) time, and O(n) if the common keys have the same order
+# (e.g. sorted _id lists). All other keys are removed and (re)inserted.
 #
-# This implementation uses python-Levenshtein, with the little issue that they use edit ops in a different way
-# than we do (TODO explain).
-def levenshtein(s1,s2):
-    # step 1: compute mapping
-    all_points = set(s1) | set(s2)
-    fwd_mapping = {}
-    bwd_mapping = {}
-    for pos,pt in enumerate(all_points):
-        fwd_mapping[pt] = pos+1 # avoid NULL?
-        bwd_mapping[pos+1] = pt
-
-    # step 2: map s1 and s2, compute result
-    s1_mapped = ''.join([chr(fwd_mapping[x]) for x in s1])
-    s2_mapped = ''.join([chr(fwd_mapping[x]) for x in s2])
-
-    pre_edit_ops = Levenshtein.editops(s1_mapped,s2_mapped)
-
-    # each op: 'replace', 'isert', 'delete' + source_pos,dest_pos
-    # we use an offset for the source position
+# Adjacent removes and inserts are merged into ranges. The removes come first, from the back to the front,
+# then the inserts, from the front to the back, so that the positions always refer to the current sequence.
+def diff_keys(s1,s2):
+    # common prefix and suffix are unchanged
+    prefix = 0
+    while prefix < len(s1) and prefix < len(s2) and s1[prefix] == s2[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < len(s1) - prefix and suffix < len(s2) - prefix and s1[-1 - suffix] == s2[-1 - suffix]:
+        suffix += 1
+    middle1 = s1[prefix:len(s1) - suffix]
+    middle2 = s2[prefix:len(s2) - suffix]
+
+    # keys which are kept in place
+    positions1 = { k: pos for pos,k in enumerate(middle1) }
+    kept = set(_longest_increasing_subsequence([ positions1[k] for k in middle2 if k in positions1 ]))
+
+    # removes (as ranges of positions in s1), from the back
     edit_ops = []
-    offset = 0
-    for peo in pre_edit_ops:
-        if peo[0] == 'insert':
-            this_op = ChangeData(ChangeType.Insert,(peo[1] + offset,1,[ s2[peo[2]] ])) 
-            offset += 1
-        elif peo[0] == 'delete':
-            this_op = ChangeData(ChangeType.Remove,(peo[1] + offset,1)) 
-            offset -= 1
-        elif peo[0] == 'replace':
-            this_op = ChangeData(ChangeType.Content,([peo[1] + offset],[ s2[peo[2]] ])) 
-        edit_ops.append(this_op)
+    pos = len(middle1) - 1
+    while pos >= 0:
+        if pos in kept:
+            pos -= 1
+            continue
+        last = pos
+        while pos >= 0 and pos not in kept:
+            pos -= 1
+        edit_ops.append(ChangeData(ChangeType.Remove,(prefix + pos + 1,last - pos)))
+
+    # inserts (as ranges of positions in s2), from the front
+    pos = 0
+    while pos < len(middle2):
+        if middle2[pos] in positions1 and positions1[middle2[pos]] in kept:
+            pos += 1
+            continue
+        first = pos
+        while pos < len(middle2) and not (middle2[pos] in positions1 and positions1[middle2[pos]] in kept):
+            pos += 1
+        edit_ops.append(ChangeData(ChangeType.Insert,(prefix + first,pos - first,list(middle2[first:pos]))))
 
     return edit_ops
 
+# Returns the longest strictly increasing subsequence of the given list of integers (patience sorting)
+def _longest_increasing_subsequence(values):
+    if all(values[i] < values[i + 1] for i in range(len(values) - 1)):
+        return values # the usual case, nothing has moved
+
+    tail_values = [] # smallest last value of an increasing subsequence of each length
+    tail_indices = []
+    predecessors = [ None ] * len(values)
+    for i,v in enumerate(values):
+        length = bisect.bisect_left(tail_values,v)
+        predecessors[i] = tail_indices[length - 1] if length > 0 else None
+        if length == len(tail_values):
+            tail_values.append(v)
+            tail_indices.append(i)
+        else:
+            tail_values[length] = v
+            tail_indices[length] = i
+
+    result = []
+    i = tail_indices[-1] if len(tail_indices) > 0 else None
+    while i is not None:
+        result.append(values[i])
+        i = predecessors[i]
+    result.reverse()
+    return result
 
 # This class implements a dictionary-style holder for (database) objects which always keeps a 
 # specified order of the underlying objects, and which sends out signals about changes to the order. 
 # The only way to change the content of the holder is the update() function, which takes a list of new keys to be loaded.
 # The *emit callables are called with suitable ChangeData whenever a change is made.
+#
+# The keys are kept in a BlockedList, so that changes to long key lists only move a few keys, and the
+# accessors count, get_key_at, get_position and has_key never scan or copy the key list.
 class ObjectHolder:
     def __init__(self,*,pre_change_emit,post_change_emit,loader,deleter):
         # params
@@ -246,20 +286,37 @@ class ObjectHolder:
     
         # Dict saves all objects, the sorted keys are contained in keylist. 
         self._dict = {}
-        self._keylist = []
+        self._keylist = BlockedList.BlockedList()
 
     def list_keys(self):
-        return self._keylist[:]
+        return self._keylist.to_list()
+
+    def count(self):
+        return len(self._keylist)
+
+    def get_key_at(self,pos):
+        return self._keylist[pos]
+
+    # Returns the position of the key, raises a ValueError if the key is not present (like list.index)
+    def get_position(self,key):
+        return self._keylist.index(key)
+
+    def has_key(self,key):
+        return key in self._keylist
 
     #TODO all this naming is not so great
     def list_values(self):
         return [ self._dict[k] for k in self._keylist ]
 
     def update(self,new_keys):
-        # first compute the required list of changes, and remember which objects will be deleted or created
-        change_list = levenshtein(self._keylist,new_keys)
-        delete_list = set(self._keylist) - set(new_keys)
-        create_list = set(new_keys) - set(self._keylist)
+        # first compute the required list of changes, and remember which objects will be deleted or created.
+        # If there are too many changes, views are better off with a single reset.
+        old_keys = self._keylist.to_list()
+        change_list = diff_keys(old_keys,new_keys)
+        if len(change_list) > Config.MaxChangeRanges:
+            change_list = [ ChangeData(ChangeType.Reset,None) ]
+        delete_list = set(old_keys) - set(new_keys)
+        create_list = set(new_keys) - set(old_keys)
 
         old_dict = self._dict.copy()
 
@@ -275,20 +332,16 @@ class ObjectHolder:
             if chg.tp == ChangeType.Remove:
                 pos = chg.info[0]
                 cnt = chg.info[1]
-                del self._keylist[pos:pos+cnt]
+                self._keylist.delete(pos,cnt)
             elif chg.tp == ChangeType.Insert:
                 pos = chg.info[0]
                 cnt = chg.info[1]
                 els = chg.info[2]
                 assert cnt == len(els)
                 assert type(els) is list
-                self._keylist[pos:pos] = els # els is a list, note that insert won't work properly
-            elif chg.tp == ChangeType.Content:
-                positions = chg.info[0]
-                elements = chg.info[1]
-                assert len(positions) == len(elements)
-                for p,e in zip(positions,elements): # note that positions might not be contiguous
-                    self._keylist[p] = e
+                self._keylist.insert(pos,els)
+            elif chg.tp == ChangeType.Reset:
+                self._keylist = BlockedList.BlockedList(new_keys)
             self._post_change_emit(chg)
 
         # delete unneeded objects
@@ -296,7 +349,15 @@ class ObjectHolder:
             self._deleter(self._dict[ok])
             del self._dict[ok]
 
-        # At this point, self._keylist contains only keys which may remain. But they may be in the wrong order.
+        # At this point, self._keylist is equal to new_keys
+
+    # Signal that the objects belonging to the given keys have changed internally (the order of keys
+    # is not affected).
+    def notify_content_changed(self,keys):
+        positions = [ self._keylist.index(k) for k in keys ]
+        chg = ChangeData(ChangeType.Content,(positions,list(keys)))
+        self._pre_change_emit(chg)
+        self._post_change_emit(chg)
 
     def forall(self,fun):
         for x in self._dict.values():